@@ -11,6 +11,867 @@ import aiohttp
 import asyncio
 import re
 import time
+import hashlib
+import base64
+import cProfile
+import io
+import pstats
+import tracemalloc
+import heapq
+import math
+from urllib.parse import urlparse
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from filelock import FileLock, Timeout
+
+import numpy as np
+
+# 表情包与情感的匹配层级（数值越大优先级越高），作为情感得分矩阵的取值
+TIER_NONE = 0
+TIER_OTHER = 1    # 非二次元，但关键词或文件名情感匹配
+TIER_ANIME = 2    # 二次元表情包，无关键词匹配
+TIER_GOOD = 3     # 二次元+次要关键词
+TIER_PERFECT = 4  # 二次元+主要关键词/文件名情感
+
+# 各层级在本地候选数量统计中的权重（与旧版候选列表中重复添加的次数一致）
+TIER_MULTIPLICITY = np.array([0, 1, 2, 2, 3], dtype=np.int64)
+
+# 维护候选池的层级（按优先级从高到低），二次元层级不包含TIER_OTHER
+POOL_TIERS = (TIER_PERFECT, TIER_GOOD, TIER_ANIME, TIER_OTHER)
+ANIME_POOL_TIERS = (TIER_PERFECT, TIER_GOOD, TIER_ANIME)
+# 从候选池抽样时的最大拒绝次数，超过后扫描整个池
+POOL_DRAW_ATTEMPTS = 8
+
+DEFAULT_EMOJI_SOURCE = "https://raw.githubusercontent.com/zhaoolee/ChineseBQB/master/chinesebqb_github.json"
+
+GITHUB_RAW_PREFIX = "https://raw.githubusercontent.com/"
+
+# 默认镜像：GitHub原始地址 + jsDelivr，可在配置中自定义
+DEFAULT_DOWNLOAD_MIRRORS = [
+    "https://raw.githubusercontent.com/{path}",
+    "https://cdn.jsdelivr.net/gh/{owner}/{repo}@{branch}/{file}",
+]
+
+# 可重试的临时HTTP状态码，以及重试退避参数(秒)
+TRANSIENT_HTTP_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 4.0
+
+# 这些HTTP状态码视为地址永久失效，负缓存使用长TTL（413/415为下载内容超过大小限制或不是图片）
+PERMANENT_FAILURE_STATUSES = {404, 410, 413, 415}
+
+# 未设置分类筛选时缓存分区记录的筛选条件
+UNFILTERED_CATEGORY_KEY = json.dumps([[], [], False])
+
+# 不超过该大小的表情包在选择时不降权，更大的按大小比例降低权重（最低0.2）
+PREFERRED_EMOJI_BYTES = 512 * 1024
+# 下载时保留在内存中用于解析图片尺寸的文件头长度
+IMAGE_HEADER_BYTES = 64 * 1024
+
+# 使用日志超过该大小时合并为热度计数文件；发送记录在内存中缓冲的时间(秒)
+USAGE_LOG_COMPACT_BYTES = 1024 * 1024
+USAGE_FLUSH_DELAY = 10
+
+# 存储日志超过该大小后轮换到下一代文件；其他进程写入的数据源分区超过保留时间未更新则从缓存中移除
+STORE_JOURNAL_ROTATE_BYTES = 1024 * 1024
+STORE_JOURNAL_PATTERN = re.compile(r"store_journal\.(\d+)\.log$")
+SOURCE_SECTION_RETENTION = 7 * 86400
+
+# 下载优先级（数值越小越优先）：回复触发的按需下载、预取、批量预下载
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "按需", PRIORITY_PREFETCH: "预取", PRIORITY_BULK: "批量"}
+
+# 跳过情感分析的回复用少量强信号关键词增量更新AI情绪，一次正则扫描；长时间没有情绪信号时回到中性
+MOOD_HINT_KEYWORDS = {
+    "happy_excited": ("哈哈", "开心", "高兴", "太好了", "太棒了", "嘻嘻"),
+    "cute_playful": ("可爱", "么么", "嘿嘿", "软萌"),
+    "caring_gentle": ("多休息", "保重", "别担心", "没关系"),
+    "surprised_curious": ("真的吗", "没想到", "竟然", "好奇"),
+    "encouraging": ("加油", "一定可以", "坚持", "相信你"),
+    "food_related": ("好吃", "美食", "饿了"),
+    "sleep_tired": ("困了", "睡觉", "晚安"),
+    "apologetic": ("对不起", "抱歉", "不好意思"),
+    "confused": ("不太明白", "搞不懂", "疑惑"),
+    "grateful": ("谢谢", "感谢"),
+}
+MOOD_HINT_LOOKUP = {keyword: emotion for emotion, keywords in MOOD_HINT_KEYWORDS.items() for keyword in keywords}
+MOOD_HINT_PATTERN = re.compile("|".join(sorted(map(re.escape, MOOD_HINT_LOOKUP), key=len, reverse=True)))
+MOOD_NEUTRAL_AFTER = 600
+
+TIER_LOCAL_DESCRIPTIONS = {
+    TIER_PERFECT: "本地完美匹配: 二次元+主题关键词",
+    TIER_GOOD: "本地良好匹配: 二次元+相关关键词",
+    TIER_ANIME: "本地二次元表情包",
+    TIER_OTHER: "本地其他匹配",
+}
+
+
+class EmojiVectorIndex:
+    """表情包字符n-gram TF-IDF向量索引（纯CPU，无需网络和GPU）
+
+    按词项存储的稀疏矩阵（类似CSC格式），查询时只累加命中词项对应的列，
+    表情包数量较大时也不会占用稠密矩阵的内存。
+    """
+
+    def __init__(self, ngram_range=(1, 3)):
+        self.ngram_range = ngram_range
+        self.vocabulary = {}
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.term_ptr = np.zeros(1, dtype=np.int64)
+        self.doc_indices = np.zeros(0, dtype=np.int32)
+        self.weights = np.zeros(0, dtype=np.float32)
+        self.doc_count = 0
+        self.fingerprint = ""
+
+    @staticmethod
+    def fingerprint_texts(texts):
+        """计算文本列表的指纹，用于判断持久化的索引是否仍然有效"""
+        return hashlib.sha1("\n".join(texts).encode("utf-8")).hexdigest()
+
+    def extract_ngrams(self, text):
+        """提取字符n-gram（跳过纯空白的片段）"""
+        text = re.sub(r"\s+", " ", text.lower()).strip()
+        ngrams = []
+        min_n, max_n = self.ngram_range
+        for n in range(min_n, max_n + 1):
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                if gram.strip():
+                    ngrams.append(gram)
+        return ngrams
+
+    def fit(self, texts):
+        """根据表情包文本构建TF-IDF矩阵"""
+        doc_terms = [Counter(self.extract_ngrams(text)) for text in texts]
+
+        vocabulary = {}
+        rows, cols, counts = [], [], []
+        for doc_index, terms in enumerate(doc_terms):
+            for term, count in terms.items():
+                term_index = vocabulary.setdefault(term, len(vocabulary))
+                rows.append(doc_index)
+                cols.append(term_index)
+                counts.append(count)
+
+        doc_count = len(texts)
+        vocab_size = len(vocabulary)
+        rows = np.asarray(rows, dtype=np.int32)
+        cols = np.asarray(cols, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.float32)
+
+        # 平滑IDF，与常见TF-IDF实现保持一致
+        document_frequency = np.bincount(cols, minlength=vocab_size)
+        idf = (np.log((1 + doc_count) / (1 + document_frequency)) + 1).astype(np.float32)
+
+        # 次线性TF，并对每个表情包向量做L2归一化
+        weights = (1 + np.log(counts)) * idf[cols] if len(cols) else counts
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=doc_count))
+        norms[norms == 0] = 1.0
+        weights = (weights / norms[rows]).astype(np.float32)
+
+        # 按词项排序，查询时可以直接切片得到命中的表情包
+        order = np.argsort(cols, kind="stable")
+        term_ptr = np.zeros(vocab_size + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=term_ptr[1:])
+
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.term_ptr = term_ptr
+        self.doc_indices = rows[order]
+        self.weights = weights[order]
+        self.doc_count = doc_count
+        self.fingerprint = self.fingerprint_texts(texts)
+        return self
+
+    def query(self, text, top_k=20):
+        """以同样方式向量化查询文本，返回余弦相似度最高的 [(表情包下标, 分数)]"""
+        if not self.doc_count:
+            return []
+
+        terms = Counter(gram for gram in self.extract_ngrams(text) if gram in self.vocabulary)
+        if not terms:
+            return []
+
+        term_ids = np.fromiter((self.vocabulary[term] for term in terms), dtype=np.int64, count=len(terms))
+        term_counts = np.fromiter(terms.values(), dtype=np.float32, count=len(terms))
+        query_weights = (1 + np.log(term_counts)) * self.idf[term_ids]
+        query_weights /= np.linalg.norm(query_weights) or 1.0
+
+        scores = np.zeros(self.doc_count, dtype=np.float32)
+        for term_id, query_weight in zip(term_ids, query_weights):
+            start, end = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            scores[self.doc_indices[start:end]] += query_weight * self.weights[start:end]
+
+        hit_indices = np.flatnonzero(scores > 0)
+        if len(hit_indices) > top_k:
+            hit_indices = hit_indices[np.argpartition(scores[hit_indices], -top_k)[-top_k:]]
+        hit_indices = hit_indices[np.argsort(scores[hit_indices])[::-1]]
+        return [(int(index), float(scores[index])) for index in hit_indices]
+
+    def save(self, path):
+        """持久化索引（不使用pickle）"""
+        vocab_terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(
+            path,
+            vocab=np.asarray(vocab_terms, dtype=str),
+            idf=self.idf,
+            term_ptr=self.term_ptr,
+            doc_indices=self.doc_indices,
+            weights=self.weights,
+            meta=np.asarray([self.fingerprint, str(self.doc_count),
+                             f"{self.ngram_range[0]},{self.ngram_range[1]}"], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """从文件加载索引"""
+        with np.load(path, allow_pickle=False) as data:
+            fingerprint, doc_count, ngram_range = data["meta"].tolist()
+            min_n, max_n = (int(n) for n in ngram_range.split(","))
+            index = cls(ngram_range=(min_n, max_n))
+            index.vocabulary = {term: i for i, term in enumerate(data["vocab"].tolist())}
+            index.idf = data["idf"]
+            index.term_ptr = data["term_ptr"]
+            index.doc_indices = data["doc_indices"]
+            index.weights = data["weights"]
+        index.doc_count = int(doc_count)
+        index.fingerprint = fingerprint
+        return index
+
+
+def sniff_image_format(header):
+    """根据文件头的魔数识别图片格式，无法识别时返回None"""
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header.startswith(b"BM"):
+        return "bmp"
+    return None
+
+
+def parse_image_size(header, image_format):
+    """从文件头解析图片宽高，返回 (宽, 高)，无法解析时返回 (None, None)"""
+    try:
+        if image_format == "gif" and len(header) >= 10:
+            return int.from_bytes(header[6:8], "little"), int.from_bytes(header[8:10], "little")
+        if image_format == "png" and len(header) >= 24:
+            return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+        if image_format == "bmp" and len(header) >= 26:
+            return int.from_bytes(header[18:22], "little"), abs(int.from_bytes(header[22:26], "little", signed=True))
+        if image_format == "webp" and len(header) >= 30:
+            chunk = header[12:16]
+            if chunk == b"VP8X":
+                return int.from_bytes(header[24:27], "little") + 1, int.from_bytes(header[27:30], "little") + 1
+            if chunk == b"VP8L":
+                bits = int.from_bytes(header[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8 ":
+                return int.from_bytes(header[26:28], "little") & 0x3FFF, int.from_bytes(header[28:30], "little") & 0x3FFF
+        if image_format == "jpeg":
+            # 逐个跳过JPEG段，直到SOF段（其中记录了高和宽）
+            offset = 2
+            while offset + 9 < len(header):
+                if header[offset] != 0xFF:
+                    offset += 1
+                    continue
+                marker = header[offset + 1]
+                if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                    return int.from_bytes(header[offset + 7:offset + 9], "big"), int.from_bytes(header[offset + 5:offset + 7], "big")
+                if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD9:
+                    offset += 2 if marker != 0xFF else 1
+                    continue
+                offset += 2 + int.from_bytes(header[offset + 2:offset + 4], "big")
+    except (IndexError, ValueError):
+        pass
+    return None, None
+
+
+def check_image_file(path, size):
+    """检查本地图片文件是否完整：文件头可识别、尺寸有效、文件尾符合格式，返回问题描述，正常时返回None"""
+    if size == 0:
+        return "空文件"
+    with open(path, 'rb') as f:
+        header = f.read(IMAGE_HEADER_BYTES)
+        f.seek(max(0, size - 64))
+        tail = f.read()
+    
+    image_format = sniff_image_format(header)
+    if image_format is None:
+        return "不是图片"
+    width, height = parse_image_size(header, image_format)
+    if width == 0 or height == 0:
+        return "图片尺寸无效"
+    
+    # 按各格式的结束标记或头部记录的长度判断是否被截断
+    if image_format == "gif" and b";" not in tail[-16:]:
+        return "文件不完整"
+    if image_format == "png" and b"IEND" not in tail:
+        return "文件不完整"
+    if image_format == "jpeg" and b"\xff\xd9" not in tail:
+        return "文件不完整"
+    if image_format == "webp" and int.from_bytes(header[4:8], "little") + 8 > size:
+        return "文件不完整"
+    if image_format == "bmp" and int.from_bytes(header[2:6], "little") > size:
+        return "文件不完整"
+    return None
+
+
+class InvalidPayloadError(Exception):
+    """下载内容不符合要求（不是图片、超过大小限制或不完整），status为记入负缓存时使用的状态码"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def emoji_size_weight(file_size):
+    """按文件大小计算的选择权重：不超过PREFERRED_EMOJI_BYTES为1，更大的按比例降低（最低0.2）"""
+    return min(1.0, max(0.2, PREFERRED_EMOJI_BYTES / max(int(file_size), 1)))
+
+
+class CandidatePool:
+    """表情包下标集合，支持O(1)的添加、删除和随机抽取"""
+
+    def __init__(self, indices=()):
+        self.items = [int(i) for i in indices]
+        self.positions = {index: position for position, index in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, index):
+        return index in self.positions
+
+    def add(self, index):
+        if index not in self.positions:
+            self.positions[index] = len(self.items)
+            self.items.append(index)
+
+    def remove(self, index):
+        position = self.positions.pop(index, None)
+        if position is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def sample(self):
+        return self.items[random.randrange(len(self.items))]
+
+
+class EmojiCatalog:
+    """表情包目录快照：表情包列表及其预计算的得分矩阵、掩码和索引
+
+    重新加载时构建新的快照并整体替换引用，正在进行的选择继续使用自己拿到的旧快照。
+    只有本地可用状态（掩码、文件大小、统计计数及候选池）会在下载和清理时通过 set_available 原地更新，
+    统计命令直接读取计数，无需遍历目录或检查文件。
+    
+    候选池按 (情感下标, 匹配层级, 是否本地可用) 分组保存表情包下标，选择时直接从池中抽取，无需扫描整列得分。
+    """
+
+    def __init__(self, emoji_data, emoji_ids, emotion_scores, anime_mask, available_mask, file_sizes, vector_index=None):
+        self.emoji_data = emoji_data
+        self.emoji_ids = emoji_ids
+        self.emotion_scores = emotion_scores
+        self.anime_mask = anime_mask
+        self.available_mask = available_mask
+        self.file_sizes = file_sizes  # 本地文件大小(字节)，未下载为0
+        self.vector_index = vector_index
+        
+        self.index_by_id = {}   # 表情包ID -> 下标列表
+        self.index_by_url = {}  # 表情包地址 -> 下标列表
+        self.index_by_path = {}  # 本地路径 -> 下标列表
+        for i, (emoji, emoji_id) in enumerate(zip(emoji_data, emoji_ids)):
+            self.index_by_id.setdefault(emoji_id, []).append(i)
+            if emoji.get("url"):
+                self.index_by_url.setdefault(emoji["url"], []).append(i)
+            if emoji.get("local_path"):
+                self.index_by_path.setdefault(os.path.normpath(emoji["local_path"]), []).append(i)
+        
+        # 统计计数
+        self.categories = [emoji.get("category", "") for emoji in emoji_data]
+        self.anime_count = int(anime_mask.sum())
+        self.category_counts = Counter(self.categories)
+        self.available_count = int(available_mask.sum())
+        self.available_category_counts = Counter(self.categories[i] for i in np.flatnonzero(available_mask))
+        self.bytes_on_disk = int(file_sizes[available_mask].sum())
+        
+        self.pools = {}
+        for j in range(emotion_scores.shape[1]):
+            column = emotion_scores[:, j]
+            for tier in POOL_TIERS:
+                tier_mask = column == tier
+                self.pools[(j, tier, True)] = CandidatePool(np.flatnonzero(tier_mask & available_mask))
+                self.pools[(j, tier, False)] = CandidatePool(np.flatnonzero(tier_mask & ~available_mask))
+
+    @classmethod
+    def empty(cls, label_count):
+        return cls([], [], np.zeros((0, label_count), dtype=np.float32),
+                   np.zeros(0, dtype=bool), np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.emoji_data)
+
+    def get_pool(self, emotion_index, tier, local):
+        return self.pools[(emotion_index, tier, local)]
+
+    def local_candidate_weight(self, emotion_index):
+        """本地候选按层级加权的数量（与旧版候选列表长度一致）"""
+        return sum(int(TIER_MULTIPLICITY[tier]) * len(self.pools[(emotion_index, tier, True)]) for tier in POOL_TIERS)
+
+    def move_between_pools(self, index, available):
+        for j, tier in enumerate(self.emotion_scores[index]):
+            tier = int(tier)
+            if tier == TIER_NONE:
+                continue
+            self.pools[(j, tier, not available)].remove(index)
+            self.pools[(j, tier, available)].add(index)
+
+    def set_available(self, indices, available, file_size=0):
+        """更新表情包的本地可用状态并同步统计计数和候选池"""
+        available = bool(available)
+        for i in indices:
+            if bool(self.available_mask[i]) != available:
+                self.move_between_pools(i, available)
+            if self.available_mask[i]:
+                self.available_count -= 1
+                self.available_category_counts[self.categories[i]] -= 1
+                self.bytes_on_disk -= int(self.file_sizes[i])
+            self.available_mask[i] = available
+            self.file_sizes[i] = file_size if available else 0
+            if available:
+                self.available_count += 1
+                self.available_category_counts[self.categories[i]] += 1
+                self.bytes_on_disk += int(self.file_sizes[i])
+
+
+class MirrorRequestError(Exception):
+    """所有镜像均请求失败，status为最后一个HTTP状态码（网络错误时为None）"""
+
+    def __init__(self, message, status=None, circuit_open=False):
+        super().__init__(message)
+        self.status = status
+        self.circuit_open = circuit_open
+
+    @property
+    def transient(self):
+        """网络错误、超时和5xx等临时错误可以重试；熔断和404等永久错误不重试"""
+        if self.circuit_open:
+            return False
+        return self.status is None or self.status in TRANSIENT_HTTP_STATUSES
+
+
+class CircuitBreaker:
+    """单个主机的熔断器：连续失败达到阈值后在冷却期内拒绝请求，冷却结束后半开试探，同时只放行一个试探请求"""
+
+    def __init__(self, failure_threshold=5, cooldown=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.total_failures = 0
+        self.rejected_requests = 0
+        self.probe_in_flight = False
+
+    def cooldown_remaining(self):
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def is_open(self):
+        """是否处于熔断冷却期（无副作用）"""
+        return self.state == "open" and self.cooldown_remaining() > 0
+
+    def can_attempt(self):
+        """是否可能放行请求（无副作用），用于挑选候选镜像"""
+        if self.state == "closed":
+            return True
+        return self.cooldown_remaining() <= 0 and not self.probe_in_flight
+
+    def allow_request(self):
+        """实际发起请求前调用；冷却结束后转为半开，只放行一个试探请求，其余请求在试探有结果前被拒绝"""
+        if self.state == "closed":
+            return True
+        if self.cooldown_remaining() > 0 or self.probe_in_flight:
+            self.rejected_requests += 1
+            return False
+        self.state = "half_open"
+        self.probe_in_flight = True
+        return True
+
+    def release_probe(self):
+        """试探请求被取消、没有结果时释放试探名额"""
+        self.probe_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.probe_in_flight = False
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    """令牌桶限流器：每分钟补充rate个令牌，最多积攒burst个"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.rejected = 0
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return self.tokens
+
+    def has_token(self):
+        return self.refill() >= 1
+
+    def consume(self):
+        self.tokens -= 1
+
+    def is_full(self):
+        return self.refill() >= self.burst
+
+
+class LoadMonitor:
+    """负载估计：指数衰减的AI回复速率和平滑后的事件循环延迟，换算为发送概率的缩放系数"""
+
+    def __init__(self, window=30.0):
+        self.window = window  # 回复速率的衰减时间常数(秒)
+        self.reply_weight = 0.0
+        self.updated_at = time.monotonic()
+        self.loop_lag = 0.0  # 秒
+
+    def decay(self):
+        now = time.monotonic()
+        self.reply_weight *= math.exp(-(now - self.updated_at) / self.window)
+        self.updated_at = now
+
+    def record_reply(self):
+        self.decay()
+        self.reply_weight += 1
+
+    def reply_rate(self):
+        """每秒回复数，负载下降后按时间常数平滑回落"""
+        self.decay()
+        return self.reply_weight / self.window
+
+    def record_lag(self, lag):
+        self.loop_lag = 0.7 * self.loop_lag + 0.3 * lag
+
+    def scale(self, rate_threshold, lag_threshold):
+        """负载未超过阈值时为1，超过时按超出倍数反比缩小"""
+        pressure = max(
+            self.reply_rate() / rate_threshold if rate_threshold > 0 else 0,
+            self.loop_lag / lag_threshold if lag_threshold > 0 else 0,
+        )
+        return 1.0 if pressure <= 1 else 1.0 / pressure
+
+
+class UsageStats:
+    """表情包使用热度：按半衰期指数衰减的单个表情包和各情感的发送计数"""
+
+    def __init__(self, half_life):
+        self.half_life = half_life
+        self.emojis = {}    # 表情包ID -> [热度, 更新时间]
+        self.emotions = {}  # 情感 -> [热度, 更新时间]
+
+    def decayed(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def add(self, counters, key, timestamp, weight=1.0):
+        entry = counters.get(key)
+        if entry is None:
+            counters[key] = [weight, timestamp]
+        elif timestamp >= entry[1]:
+            counters[key] = [self.decayed(entry, timestamp) + weight, timestamp]
+        else:
+            # 早于当前计数的事件（合并其他进程的日志时）按其发生时间衰减后计入
+            entry[0] += weight * 0.5 ** ((entry[1] - timestamp) / self.half_life)
+
+    def record(self, emoji_id, emotion, timestamp):
+        self.add(self.emojis, emoji_id, timestamp)
+        if emotion:
+            self.add(self.emotions, emotion, timestamp)
+
+    def emoji_score(self, emoji_id, now=None):
+        entry = self.emojis.get(emoji_id)
+        return self.decayed(entry, now or time.time()) if entry else 0.0
+
+    def emotion_score(self, emotion, now=None):
+        entry = self.emotions.get(emotion)
+        return self.decayed(entry, now or time.time()) if entry else 0.0
+
+    def top(self, counters, count):
+        now = time.time()
+        return sorted(((key, self.decayed(entry, now)) for key, entry in counters.items()), key=lambda item: -item[1])[:count]
+
+    def prune(self, min_score=0.01):
+        """丢弃热度衰减到可以忽略的条目"""
+        now = time.time()
+        for counters in (self.emojis, self.emotions):
+            for key in [key for key, entry in counters.items() if self.decayed(entry, now) < min_score]:
+                del counters[key]
+
+    def to_dict(self):
+        return {"half_life": self.half_life, "emojis": self.emojis, "emotions": self.emotions}
+
+    @classmethod
+    def from_dict(cls, data, half_life):
+        stats = cls(half_life)
+        stats.emojis = {key: list(entry) for key, entry in data.get("emojis", {}).items()}
+        stats.emotions = {key: list(entry) for key, entry in data.get("emotions", {}).items()}
+        return stats
+
+
+class PayloadCache:
+    """已编码图片数据的LRU缓存，按总字节数限制内存占用
+
+    键为 (表情包ID, 文件修改时间)，文件被替换后自然失效
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        payload = self.entries.get(key)
+        if payload is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, key, payload):
+        # 单个数据超过容量的1/4时不缓存，避免挤掉大量常用表情包
+        if len(payload) > self.max_bytes // 4:
+            return
+        if key in self.entries:
+            self.total_bytes -= len(self.entries.pop(key))
+        self.entries[key] = payload
+        self.total_bytes += len(payload)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class PipelineProfiler:
+    """按需开启的性能分析：在被采样的调用期间启用cProfile，整个采样期间启用tracemalloc
+
+    达到事件数量或时间上限后自动停止，关闭时插件只做一次属性检查，没有额外开销
+    """
+
+    def __init__(self, max_events=0, max_seconds=0):
+        self.max_events = max_events
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic()
+        self.events = Counter()  # 采样位置 -> 次数
+        self.profile = cProfile.Profile()
+        # 已有其他性能分析工具在运行时这里会抛出ValueError
+        self.profile.enable()
+        self.profile.disable()
+        self.active = 0  # 正在采样的调用数（并发的调用共享同一段采样）
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start(10)
+
+    def begin(self, name):
+        self.events[name] += 1
+        if self.active == 0:
+            self.profile.enable()
+        self.active += 1
+
+    def end(self):
+        self.active -= 1
+        if self.active == 0:
+            self.profile.disable()
+
+    def is_finished(self):
+        if self.max_events and sum(self.events.values()) >= self.max_events:
+            return True
+        return bool(self.max_seconds) and time.monotonic() - self.started_at >= self.max_seconds
+
+    def finish(self, output_prefix):
+        """停止采样并写入 .pstats 和文本报告（在线程池中执行），返回报告文件路径"""
+        if self.active:
+            self.profile.disable()
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        
+        pstats_file = output_prefix + ".pstats"
+        self.profile.dump_stats(pstats_file)
+        
+        report = io.StringIO()
+        report.write(f"采样时长: {time.monotonic() - self.started_at:.1f}s\n")
+        report.write("采样事件: " + ", ".join(f"{name}×{count}" for name, count in self.events.items()) + "\n\n")
+        report.write("=== CPU耗时（按累计时间排序，前30项） ===\n")
+        try:
+            pstats.Stats(self.profile, stream=report).sort_stats("cumulative").print_stats(30)
+        except TypeError:
+            report.write("没有采样数据\n")
+        if snapshot is not None:
+            report.write("\n=== 内存分配（按代码行统计，前30项） ===\n")
+            for stat in snapshot.statistics("lineno")[:30]:
+                report.write(f"{stat}\n")
+        
+        report_file = output_prefix + "_report.txt"
+        with open(report_file, 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        return pstats_file, report_file
+
+
+class MirrorStats:
+    """单个镜像的首字节延迟（EWMA）和成功率统计"""
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.latency = None     # 首字节延迟的指数加权平均(秒)
+        self.deviation = 0.0    # 延迟的指数加权平均偏差
+        self.successes = 0
+        self.failures = 0
+
+    def record_success(self, latency):
+        self.record_latency(latency)
+        self.successes += 1
+
+    def record_latency(self, latency):
+        """只记录延迟样本（例如对冲请求落败被取消时，已等待的时间是延迟的下限）"""
+        if self.latency is None:
+            self.latency = latency
+            self.deviation = latency / 2
+        else:
+            self.deviation += self.alpha * (abs(latency - self.latency) - self.deviation)
+            self.latency += self.alpha * (latency - self.latency)
+
+    def record_failure(self):
+        self.failures += 1
+
+    @property
+    def success_rate(self):
+        # 拉普拉斯平滑，新镜像按50%估计
+        return (self.successes + 1) / (self.successes + self.failures + 2)
+
+    def score(self, default_latency=0.5):
+        """期望代价，越小越好：延迟 / 成功率"""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency / self.success_rate
+
+    def hedge_delay(self, default_delay=1.0):
+        """对冲请求前等待首字节的时间，接近该镜像的高分位延迟"""
+        if self.latency is None:
+            return default_delay
+        return self.latency + 4 * self.deviation
+
+
+class DownloadScheduler:
+    """下载调度：按优先级分配全局和单主机的并发名额，记录各优先级的排队时间
+    
+    排队的任务按优先级顺序获得名额，按需下载总是排在后台任务之前；后台任务在全局和单主机上都最多使用
+    名额减去为按需下载保留的名额，后台任务占满连接时按需下载也不需要等待。
+    """
+
+    def __init__(self, global_limit, per_host_limit, reserved_interactive=1):
+        self.global_limit = global_limit
+        self.per_host_limit = per_host_limit
+        self.reserved_interactive = reserved_interactive
+        self.waiters = []  # 堆: (优先级, 序号, 主机, future, 入队时间)
+        self.sequence = 0
+        self.active = 0
+        self.active_by_host = Counter()
+        self.active_by_priority = Counter()
+        self.completed = Counter()
+        self.queue_times = {priority: deque(maxlen=256) for priority in PRIORITY_NAMES}
+
+    def configure(self, global_limit, per_host_limit):
+        self.global_limit = global_limit
+        self.per_host_limit = per_host_limit
+        self.dispatch()
+
+    def can_start(self, priority, host):
+        limit, host_limit = self.global_limit, self.per_host_limit
+        if priority != PRIORITY_INTERACTIVE:
+            # 几乎所有表情包都来自同一主机，保留名额需要同时作用于全局和单主机上限
+            limit = max(1, limit - self.reserved_interactive)
+            host_limit = max(1, host_limit - self.reserved_interactive)
+        return self.active < limit and self.active_by_host[host] < host_limit
+
+    def dispatch(self):
+        """按优先级顺序分配空闲名额，主机名额已满的任务不阻塞其他主机的任务"""
+        blocked = []
+        while self.waiters:
+            item = heapq.heappop(self.waiters)
+            priority, _, host, future, enqueued_at = item
+            if future.done():
+                continue
+            if not self.can_start(priority, host):
+                blocked.append(item)
+                continue
+            self.active += 1
+            self.active_by_host[host] += 1
+            self.active_by_priority[priority] += 1
+            self.queue_times[priority].append(time.monotonic() - enqueued_at)
+            future.set_result(None)
+        for item in blocked:
+            heapq.heappush(self.waiters, item)
+
+    async def acquire(self, priority, host):
+        future = asyncio.get_running_loop().create_future()
+        self.sequence += 1
+        heapq.heappush(self.waiters, (priority, self.sequence, host, future, time.monotonic()))
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分配名额后被取消，归还名额
+                self.release(priority, host)
+            raise
+
+    def release(self, priority, host):
+        self.active -= 1
+        self.active_by_host[host] -= 1
+        self.active_by_priority[priority] -= 1
+        self.completed[priority] += 1
+        self.dispatch()
+
+    def queued_count(self, priority):
+        return sum(1 for item in self.waiters if item[0] == priority and not item[3].done())
+
+    def queue_time_stats(self, priority):
+        """最近的排队时间 (平均, p95)，单位秒"""
+        samples = sorted(self.queue_times[priority])
+        if not samples:
+            return 0.0, 0.0
+        return sum(samples) / len(samples), samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
 
 @register("letai_sendemojis", "Heyh520", "让AI智能发送表情包的AstrBot插件", "1.0.0")
 class LetAISendEmojisPlugin(Star):
@@ -19,22 +880,69 @@ class LetAISendEmojisPlugin(Star):
         
         # 加载配置文件
         self.config = config
+        self.apply_config()
         
-        # 初始化配置参数
-        self.enable_context_parsing = self.config.get("enable_context_parsing", True)
-        self.send_probability = self.config.get("send_probability", 0.3)
-        self.request_timeout = self.config.get("request_timeout", 15)
+        self.mirror_stats = {}  # 镜像 -> MirrorStats
+        self.circuit_breakers = {}  # 主机 -> CircuitBreaker
+        self.negative_cache = {}  # url -> {"status", "failures", "expires_at"}
+        self.cache_save_task = None
+        
+        self.predownload_task = None
+        self.predownload_progress = {}
+        
+        # 表情包最后使用时间，用于按未使用时长清理
+        self.last_used_at = {}  # 表情包ID -> 时间戳
+        self.usage_dirty = False
+        
+        # 使用热度计数，发送记录批量追加到使用日志
+        self.usage_stats = UsageStats(self.usage_half_life)
+        self.usage_pending = []
+        self.usage_flush_task = None
+        self.cleanup_lock = asyncio.Lock()
         
-        # 智能解析表情包数据源
-        emoji_source = self.config.get("emoji_source", "").strip()
-        self.emoji_source = emoji_source if emoji_source else "https://raw.githubusercontent.com/zhaoolee/ChineseBQB/master/chinesebqb_github.json"
+        # 数据源热重载
+        self.reload_lock = asyncio.Lock()
+        self.source_watch_task = None
+        
+        # 性能分析：未开启时为None
+        self.profiler = None
+        self.profiler_timer = None
+        
+        # 本地文件完整性检查
+        self.integrity_task = None
+        self.integrity_summary = {}
+        
+        # 负载自适应发送概率
+        self.load_monitor = LoadMonitor()
+        self.load_monitor_task = None
+        
+        # 各阶段跳过次数：not_ready(预热未完成) load_shed(负载过高) probability_gate(廉价门控) rate_limit(限流) decision(分析后决定不发送) no_emoji(无合适表情包)
+        self.pipeline_skips = Counter()
+        
+        # 发送限流拒绝次数
+        self.global_rate_rejections = 0
+        self.chat_rate_rejections = 0
+        
+        # 多进程共享存储：其他进程完成的下载和清理通过存储日志同步
+        self.store_journal_position = (0, 0)  # (日志代数, 已读取的字节数)
+        self.store_journal_pending = []  # 待写入的存储日志记录，按顺序在线程池中写入
+        self.store_journal_task = None
+        self.store_sync_task = None
+        
+        # 后台预热：initialize立即返回，缓存快照和完整加载在后台任务中完成
+        self.warmup_task = None
+        self.startup_started_at = None
+        self.readiness = {}  # 阶段 -> 启动后耗时(秒)：cache(缓存快照可用) full(完整加载完成)
         
         # 插件工作目录（固定在插件目录下）
         self.plugin_dir = os.path.dirname(__file__)
         self.emoji_directory = os.path.join(self.plugin_dir, "emojis")
         
-        # 初始化表情包数据
-        self.emoji_data = []
+        # 初始化表情包数据：目录快照包含表情包列表、得分矩阵、掩码和向量索引
+        self.emotion_labels = list(self.get_emotion_keyword_mapping())
+        self.catalog = EmojiCatalog.empty(len(self.emotion_labels))
+        self.source_sections = {}  # 数据源ID -> 该数据源的缓存分区
+        self.catalog_diff = {}  # 最近一次加载与旧目录的差异统计
         
         # 添加表情包使用历史记录，避免短期重复
         self.recent_used_emojis = []  # 存储最近使用的表情包
@@ -44,132 +952,741 @@ class LetAISendEmojisPlugin(Star):
         self.conversation_context = []  # 存储对话上下文
         self.max_context_length = 5  # 记住最近5轮对话
         self.current_ai_mood = "neutral"  # AI当前情绪状态
+        self.mood_updated_at = 0.0  # 上次有情绪信号更新AI情绪的时间
         self.mood_consistency_factor = 0.7  # 情绪一致性系数
         
         logger.info(f"LetAI表情包插件初始化完成 - 配置: enable_context_parsing={self.enable_context_parsing}, send_probability={self.send_probability}")
-        logger.info(f"表情包数据源: {self.emoji_source}")
+        logger.info(f"表情包数据源: {', '.join(self.emoji_sources)}")
         logger.info(f"表情包工作目录: {self.emoji_directory}")
 
+    def apply_config(self):
+        """从配置中读取参数（初始化和热重载时调用）"""
+        # 初始化配置参数
+        self.enable_context_parsing = self.config.get("enable_context_parsing", True)
+        self.send_probability = self.config.get("send_probability", 0.3)
+        self.request_timeout = self.config.get("request_timeout", 15)
+        
+        # 表情包选择模式: keyword(关键词匹配) 或 vector(TF-IDF向量检索)
+        self.selection_mode = self.config.get("selection_mode", "keyword")
+        self.vector_top_k = self.config.get("vector_top_k", 20)
+        
+        # 下载镜像：索引和图片的GitHub地址按顺序尝试，优先选择延迟低、成功率高的镜像
+        self.download_mirrors = self.config.get("download_mirrors", DEFAULT_DOWNLOAD_MIRRORS) or DEFAULT_DOWNLOAD_MIRRORS
+        self.enable_hedged_requests = self.config.get("enable_hedged_requests", True)
+        
+        # 下载熔断与重试：主机连续失败后在冷却期内直接使用本地表情包
+        self.circuit_breaker_threshold = self.config.get("circuit_breaker_threshold", 5)
+        self.circuit_breaker_cooldown = self.config.get("circuit_breaker_cooldown", 60)
+        self.download_max_retries = self.config.get("download_max_retries", 2)
+        
+        # 失效地址负缓存：永久失效(404等)的地址长期排除，超时等临时失败很快过期
+        self.negative_cache_ttl = self.config.get("negative_cache_ttl", 7 * 24 * 3600)
+        self.negative_cache_transient_ttl = self.config.get("negative_cache_transient_ttl", 300)
+        
+        # 批量预下载：有界并发的后台任务，可中断、重启后自动续传
+        self.predownload_on_startup = self.config.get("predownload_on_startup", False)
+        self.predownload_filter = self.config.get("predownload_filter", "anime top=5")
+        self.predownload_concurrency = self.config.get("predownload_concurrency", 3)
+        self.predownload_interval = self.config.get("predownload_interval", 0.5)
+        
+        # 下载调度：所有下载共享全局和单主机并发上限，按需下载优先于预取和批量预下载
+        self.download_concurrency = max(2, self.config.get("download_concurrency", 6))
+        self.download_per_host_limit = max(1, self.config.get("download_per_host_limit", 4))
+        if getattr(self, "download_scheduler", None) is None:
+            self.download_scheduler = DownloadScheduler(self.download_concurrency, self.download_per_host_limit)
+        else:
+            self.download_scheduler.configure(self.download_concurrency, self.download_per_host_limit)
+        
+        # 分类筛选：加载时直接丢弃不需要的表情包，不进入目录和索引
+        self.category_allowlist = [keyword.lower() for keyword in self.config.get("category_allowlist", []) if keyword]
+        self.category_denylist = [keyword.lower() for keyword in self.config.get("category_denylist", []) if keyword]
+        self.anime_only = self.config.get("anime_only", False)
+        # 筛选条件写入缓存分区，条件变化后不再复用旧分区
+        self.category_filter_key = json.dumps([self.category_allowlist, self.category_denylist, self.anime_only], ensure_ascii=False)
+        
+        # 本地JSON/目录数据源的变更检测间隔(秒)，0为关闭
+        self.source_watch_interval = self.config.get("source_watch_interval", 10)
+        
+        # 表情包发送限流：每个会话和全局各一个令牌桶(每分钟次数/突发容量)，速率为0时关闭
+        self.chat_rate_limit = self.config.get("chat_rate_limit", 6)
+        self.chat_rate_burst = self.config.get("chat_rate_burst", 3)
+        self.global_rate_limit = self.config.get("global_rate_limit", 30)
+        self.global_rate_burst = self.config.get("global_rate_burst", 10)
+        self.chat_buckets = {}  # 会话 -> TokenBucket，配置变化后重新创建
+        self.global_bucket = None
+        
+        # 使用热度：发送记录写入追加日志，定期合并为按半衰期衰减的热度计数，用于预取、清理和加权选择
+        self.usage_half_life = self.config.get("usage_half_life_days", 7) * 86400
+        self.popularity_weight = min(1.0, max(0.0, self.config.get("popularity_weight", 0.3)))
+        if getattr(self, "usage_stats", None) is not None:
+            self.usage_stats.half_life = self.usage_half_life
+        
+        # 本地文件完整性检查：启动后在线程池中并行校验，损坏的文件移入隔离目录
+        self.integrity_scan_on_startup = self.config.get("integrity_scan_on_startup", True)
+        self.integrity_scan_workers = max(1, self.config.get("integrity_scan_workers", 4))
+        
+        # 负载自适应：回复速率或事件循环延迟超过阈值时按比例降低发送概率，配置的发送概率为上限
+        self.adaptive_send = self.config.get("adaptive_send_probability", False)
+        self.adaptive_reply_rate = self.config.get("adaptive_reply_rate", 1.0)
+        self.adaptive_loop_lag = self.config.get("adaptive_loop_lag_ms", 100) / 1000
+        
+        # 单个表情包的最大下载大小(MB)，超过时立即中止下载
+        self.max_emoji_bytes = int(self.config.get("max_emoji_size_mb", 5) * 1024 * 1024)
+        
+        # 热门表情包的已编码数据缓存(MB)，0为关闭
+        payload_cache_bytes = int(self.config.get("payload_cache_mb", 16) * 1024 * 1024)
+        if payload_cache_bytes <= 0:
+            self.payload_cache = None
+        elif getattr(self, "payload_cache", None) is None or self.payload_cache.max_bytes != payload_cache_bytes:
+            self.payload_cache = PayloadCache(payload_cache_bytes)
+        
+        # 多个AstrBot进程共享插件目录时，同步其他进程下载/清理结果的间隔(秒)，0为关闭
+        self.store_sync_interval = self.config.get("store_sync_interval", 5)
+        
+        # 智能解析表情包数据源，支持单个字符串或多个数据源组成的列表
+        emoji_source = self.config.get("emoji_source", [])
+        if isinstance(emoji_source, str):
+            emoji_source = [emoji_source]
+        self.emoji_sources = [source.strip() for source in emoji_source if isinstance(source, str) and source.strip()]
+        if not self.emoji_sources:
+            self.emoji_sources = [DEFAULT_EMOJI_SOURCE]
+    
+    @property
+    def emoji_data(self):
+        """当前目录快照中的表情包列表"""
+        return self.catalog.emoji_data
+
     async def initialize(self):
-        """插件初始化方法，加载表情包数据"""
-        await self.load_emoji_data()
-        logger.info(f"LetAI表情包插件已初始化，表情包数量: {len(self.emoji_data)}")
+        """插件初始化方法：立即返回，表情包数据在后台预热任务中加载"""
+        # 目录构建时已检查过本地文件，只需同步此后其他进程写入的存储日志
+        self.store_journal_position = self.get_store_journal_end()
+        self.startup_started_at = time.monotonic()
+        self.warmup_task = asyncio.create_task(self.warm_up())
+        self.start_load_monitor()
+        logger.info("LetAI表情包插件已初始化，表情包数据后台加载中")
+    
+    def is_warming_up(self):
+        return self.warmup_task is not None and not self.warmup_task.done()
+    
+    async def warm_up(self):
+        """后台预热：先发布本地缓存中的目录快照使插件尽快可用，再完整加载数据源，最后启动后台任务"""
+        try:
+            await self.load_usage_stats()
+            async with self.reload_lock:
+                cached_sections = await self.publish_cached_catalog()
+                if self.catalog.emoji_data:
+                    self.readiness["cache"] = time.monotonic() - self.startup_started_at
+                    logger.info(f"缓存快照已可用: {len(self.catalog)} 个表情包, 启动后 {self.readiness['cache']:.2f}s")
+                await self.load_emoji_data(cached_sections)
+            self.readiness["full"] = time.monotonic() - self.startup_started_at
+            logger.info(f"表情包数据加载完成，表情包数量: {len(self.emoji_data)}, 启动后 {self.readiness['full']:.2f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"表情包数据加载失败: {e}")
+        
+        if self.integrity_scan_on_startup:
+            self.integrity_task = asyncio.create_task(self.run_integrity_scan())
+        
+        # 上次未完成的预下载任务自动续传，否则按配置在启动时预下载
+        # 筛选条件无效时只记录错误，不影响后续的数据源监控和共享目录同步
+        saved_state = self.load_predownload_state()
+        try:
+            if saved_state.get("status") == "running":
+                logger.info(f"继续上次未完成的预下载任务: {saved_state.get('filter')}")
+                self.start_predownload(saved_state.get("filter", ""), saved_state.get("priority", PRIORITY_BULK))
+            elif self.predownload_on_startup:
+                self.start_predownload(self.predownload_filter, PRIORITY_PREFETCH)
+        except ValueError as e:
+            logger.error(f"启动预下载失败: {e}")
+        
+        self.start_source_watcher()
+        if self.store_sync_interval > 0:
+            self.store_sync_task = asyncio.create_task(self.watch_shared_store())
     
     async def terminate(self):
         """插件销毁方法"""
+        if self.is_warming_up():
+            self.warmup_task.cancel()
+        if self.profiler is not None:
+            await self.stop_profiling()
+        if self.source_watch_task:
+            self.source_watch_task.cancel()
+        if self.load_monitor_task:
+            self.load_monitor_task.cancel()
+        if self.integrity_task and not self.integrity_task.done():
+            self.integrity_task.cancel()
+        if self.store_sync_task:
+            self.store_sync_task.cancel()
+        if self.predownload_task and not self.predownload_task.done():
+            # 保持running状态，下次启动时续传
+            self.predownload_task.cancel()
+            self.save_predownload_state("running")
+        if self.usage_flush_task and not self.usage_flush_task.done():
+            self.usage_flush_task.cancel()
+        await self.flush_usage_log()
+        if self.store_journal_task and not self.store_journal_task.done():
+            await self.store_journal_task
+        if (self.cache_save_task and not self.cache_save_task.done()) or self.usage_dirty:
+            # 立即写入尚未保存的负缓存和使用时间
+            if self.cache_save_task:
+                self.cache_save_task.cancel()
+            await self.save_cache()
         logger.info("LetAI表情包插件已停止")
     
-    async def load_emoji_data(self):
-        """智能加载表情包数据，支持多种数据源"""
+    async def load_emoji_data(self, cached_sections=None):
+        """加载表情包数据，开启性能分析时对本次加载采样"""
+        if self.profiler is None:
+            return await self.load_and_build_catalog(cached_sections)
+        return await self.run_profiled("load_emoji_data", self.load_and_build_catalog(cached_sections))
+    
+    async def publish_cached_catalog(self):
+        """只用本地缓存构建并发布目录快照（不访问网络），返回读取到的缓存分区"""
+        cached_sections = await self.load_from_cache()
+        source_ids = {self.get_source_id(source) for source in self.emoji_sources}
+        sections = {source_id: self.filter_cached_section(section)
+                    for source_id, section in cached_sections.items() if source_id in source_ids}
+        merged_data = self.merge_source_sections(sections)
+        if merged_data:
+            previous = self.catalog
+            loop = asyncio.get_running_loop()
+            catalog, _, reused_from = await loop.run_in_executor(None, self.build_catalog, merged_data, previous)
+            self.source_sections = sections
+            self.publish_catalog(catalog, previous, reused_from)
+        return cached_sections
+    
+    async def load_and_build_catalog(self, cached_sections=None):
+        """智能加载表情包数据，多个数据源并发加载后合并为统一目录
+        
+        cached_sections 为已读取的缓存分区，未提供时从缓存文件读取
+        """
         logger.info("开始加载表情包数据...")
         
         # 确保工作目录存在
         os.makedirs(self.emoji_directory, exist_ok=True)
         
-        # 智能判断数据源类型并加载
-        source_type = self.detect_source_type(self.emoji_source)
-        logger.info(f"检测到数据源类型: {source_type}")
+        if cached_sections is None:
+            cached_sections = await self.load_from_cache()
         
-        if source_type == "cached":
-            # 优先使用缓存
-            if await self.load_from_cache():
-                logger.info(f"从缓存加载完成，共 {len(self.emoji_data)} 个表情包")
-                return
+        # 所有数据源并发加载，单个数据源失败不影响其他数据源
+        results = await asyncio.gather(
+            *(self.load_source(source, cached_sections.get(self.get_source_id(source))) for source in self.emoji_sources),
+            return_exceptions=True,
+        )
         
-        if source_type == "url":
-            await self.load_from_url()
-        elif source_type == "json_file":
-            await self.load_from_json_file()
-        elif source_type == "directory":
-            await self.load_from_directory()
+        sections = {}
+        refreshed_count = 0
+        for source, result in zip(self.emoji_sources, results):
+            source_id = self.get_source_id(source)
+            cached_section = cached_sections.get(source_id)
+            if isinstance(result, Exception):
+                logger.error(f"数据源加载失败: {source} - {result}")
+                result = cached_section
+            if not result:
+                continue
+            if result is cached_section:
+                result = self.filter_cached_section(result)
+            sections[source_id] = result
+            if result is not cached_section:
+                refreshed_count += 1
+        
+        self.source_sections = sections
+        merged_data = self.merge_source_sections(sections)
+        logger.info(f"表情包数据加载完成，共 {len(merged_data)} 个表情包（{len(sections)}/{len(self.emoji_sources)} 个数据源可用，{refreshed_count} 个已刷新）")
+        
+        # 在线程池中构建新的目录快照（未变化的表情包复用旧快照的索引），构建期间回复处理继续使用旧快照
+        previous = self.catalog
+        loop = asyncio.get_running_loop()
+        catalog, diff, reused_from = await loop.run_in_executor(None, self.build_catalog, merged_data, previous)
+        synced_count = self.publish_catalog(catalog, previous, reused_from)
+        if synced_count:
+            logger.debug(f"同步构建期间的本地可用状态变化: {synced_count} 个")
+        self.catalog_diff = diff
+        logger.info(f"表情包目录已更新: 新增{diff['added']}个, 删除{diff['removed']}个, 变更{diff['changed']}个, 复用{diff['reused']}个")
+        
+        # 只有数据源内容发生变化时才重写缓存
+        if refreshed_count or set(sections) != set(cached_sections):
+            await self.save_cache()
+    
+    async def reload_emoji_data(self, reload_config=False):
+        """热重载：可选地重新读取配置文件，然后增量更新表情包目录"""
+        async with self.reload_lock:
+            if reload_config:
+                config_path = getattr(self.config, "config_path", None)
+                if config_path and os.path.exists(config_path):
+                    with open(config_path, 'r', encoding='utf-8-sig') as f:
+                        self.config.update(json.load(f))
+                self.apply_config()
+                self.start_source_watcher()
+                self.start_load_monitor()
+            
+            previous_count = len(self.catalog)
+            await self.load_emoji_data()
+            return previous_count, len(self.catalog)
+    
+    def get_local_source_signature(self):
+        """本地JSON文件和目录数据源的变更签名（文件修改时间、目录树修改时间）"""
+        signature = {}
+        for source in self.emoji_sources:
+            if source.startswith(("http://", "https://")):
+                continue
+            try:
+                if os.path.isfile(source):
+                    signature[source] = os.path.getmtime(source)
+                elif os.path.isdir(source):
+                    signature[source] = sorted((root, os.path.getmtime(root)) for root, _, _ in os.walk(source))
+            except OSError:
+                signature[source] = None
+        return signature
+    
+    def start_source_watcher(self):
+        """按配置启动本地数据源变更检测（已在运行时不重复启动）"""
+        if self.source_watch_interval > 0 and (self.source_watch_task is None or self.source_watch_task.done()):
+            self.source_watch_task = asyncio.create_task(self.watch_local_sources())
+    
+    def start_load_monitor(self):
+        """开启负载自适应时启动事件循环延迟采样（已在运行时不重复启动）"""
+        if self.adaptive_send and (self.load_monitor_task is None or self.load_monitor_task.done()):
+            self.load_monitor_task = asyncio.create_task(self.monitor_loop_lag())
+    
+    async def monitor_loop_lag(self, interval=0.5):
+        """定期测量sleep的超时量作为事件循环延迟"""
+        loop = asyncio.get_running_loop()
+        while self.adaptive_send:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.load_monitor.record_lag(max(0.0, loop.time() - started - interval))
+    
+    async def watch_local_sources(self):
+        """定期检查本地数据源，发生变化时自动热重载"""
+        loop = asyncio.get_running_loop()
+        last_signature = await loop.run_in_executor(None, self.get_local_source_signature)
+        while self.source_watch_interval > 0:
+            await asyncio.sleep(self.source_watch_interval)
+            try:
+                signature = await loop.run_in_executor(None, self.get_local_source_signature)
+                if signature != last_signature:
+                    logger.info("检测到本地数据源变化，开始热重载")
+                    await self.reload_emoji_data()
+                    # 重载期间配置可能改变了数据源列表，重新计算签名
+                    signature = await loop.run_in_executor(None, self.get_local_source_signature)
+                last_signature = signature
+            except Exception as e:
+                logger.warning(f"本地数据源热重载失败: {e}")
+    
+    def is_same_emoji(self, old_emoji, new_emoji):
+        """判断表情包条目是否未发生会影响索引的变化"""
+        return all(old_emoji.get(key) == new_emoji.get(key) for key in ("name", "category", "url", "local_path"))
+    
+    def compute_emotion_row(self, emoji, mapping, anime_categories):
+        """计算单个表情包在各情感标签上的得分（匹配层级）以及是否为二次元
+        
+        得分取值为匹配层级(TIER_*)，由主要/次要关键词、二次元判断和文件名情感共同决定
+        """
+        emoji_name = emoji.get("name", "").lower()
+        emoji_category = emoji.get("category", "").lower()
+        search_text = f"{emoji_name} {emoji_category}"
+        
+        is_anime = self.is_anime_emoji(emoji_name, emoji_category, anime_categories)
+        name_emotions = self.extract_emotion_from_filename(emoji_name)
+        
+        row = np.zeros(len(self.emotion_labels), dtype=np.float32)
+        for j, label in enumerate(self.emotion_labels):
+            primary_keywords = mapping[label]["primary"]
+            secondary_keywords = mapping[label]["secondary"]
+            primary_match = any(keyword in search_text for keyword in primary_keywords)
+            secondary_match = any(keyword in search_text for keyword in secondary_keywords)
+            emotion_enhanced_match = any(emotion in primary_keywords or emotion in secondary_keywords
+                                         for emotion in name_emotions)
+            
+            if is_anime and (primary_match or emotion_enhanced_match):
+                row[j] = TIER_PERFECT
+            elif is_anime and secondary_match:
+                row[j] = TIER_GOOD
+            elif is_anime:
+                row[j] = TIER_ANIME
+            elif primary_match or secondary_match or emotion_enhanced_match:
+                row[j] = TIER_OTHER
+        return row, is_anime
+    
+    def build_catalog(self, emoji_data, previous=None):
+        """构建新的目录快照：预计算表情包×情感标签的得分矩阵，以及二次元、本地可用掩码
+        
+        与旧快照对比，未变化的表情包直接复用旧快照中的得分行和本地可用状态，
+        只为新增和变更的表情包重新计算。在线程池中运行，不修改旧快照。
+        返回 (快照, 差异统计, 各表情包在旧快照中的下标(新增为-1))
+        """
+        start_time = time.time()
+        mapping = self.get_emotion_keyword_mapping()
+        anime_categories = self.get_anime_categories()
+        emoji_count = len(emoji_data)
+        emoji_ids = [self.get_emoji_id(emoji) for emoji in emoji_data]
+        
+        scores = np.zeros((emoji_count, len(self.emotion_labels)), dtype=np.float32)
+        anime_mask = np.zeros(emoji_count, dtype=bool)
+        available_mask = np.zeros(emoji_count, dtype=bool)
+        file_sizes = np.zeros(emoji_count, dtype=np.int64)
+        reused_from = np.full(emoji_count, -1, dtype=np.int64)
+        
+        previous_rows = {}
+        if previous is not None:
+            for old_index, old_id in enumerate(previous.emoji_ids):
+                previous_rows.setdefault(old_id, old_index)
+        
+        diff = {"added": 0, "removed": 0, "changed": 0, "reused": 0}
+        for i, emoji in enumerate(emoji_data):
+            old_index = previous_rows.get(emoji_ids[i])
+            if old_index is not None and self.is_same_emoji(previous.emoji_data[old_index], emoji):
+                scores[i] = previous.emotion_scores[old_index]
+                anime_mask[i] = previous.anime_mask[old_index]
+                available_mask[i] = previous.available_mask[old_index]
+                file_sizes[i] = previous.file_sizes[old_index]
+                reused_from[i] = old_index
+                diff["reused"] += 1
+                continue
+            
+            diff["added" if old_index is None else "changed"] += 1
+            scores[i], anime_mask[i] = self.compute_emotion_row(emoji, mapping, anime_categories)
+            file_size = self.get_local_file_size(emoji)
+            available_mask[i] = file_size is not None
+            file_sizes[i] = file_size or 0
+        diff["removed"] = len(set(previous_rows) - set(emoji_ids))
+        
+        previous_index = previous.vector_index if previous is not None else None
+        vector_index = self.build_vector_index(emoji_data, previous_index)
+        catalog = EmojiCatalog(emoji_data, emoji_ids, scores, anime_mask, available_mask, file_sizes, vector_index)
+        logger.info(f"情感得分矩阵构建完成: {scores.shape[0]}×{scores.shape[1]}, "
+                    f"二次元{int(anime_mask.sum())}个, 本地可用{int(available_mask.sum())}个, 耗时 {time.time() - start_time:.2f}s")
+        return catalog, diff, reused_from
+    
+    def publish_catalog(self, catalog, previous, reused_from):
+        """在事件循环中发布新快照：先补上构建期间旧快照上发生的下载和清理，再一次性替换引用
+        
+        返回补同步的表情包数量
+        """
+        reused = np.flatnonzero(reused_from >= 0)
+        old_indices = reused_from[reused]
+        changed = reused[(previous.available_mask[old_indices] != catalog.available_mask[reused])
+                         | (previous.file_sizes[old_indices] != catalog.file_sizes[reused])]
+        for i in changed.tolist():
+            old_index = int(reused_from[i])
+            catalog.set_available([i], bool(previous.available_mask[old_index]), int(previous.file_sizes[old_index]))
+        self.catalog = catalog
+        return len(changed)
+    
+    def get_recent_used_mask(self, catalog):
+        """最近使用过的表情包掩码"""
+        mask = np.zeros(len(catalog), dtype=bool)
+        for emoji_id in self.recent_used_emojis:
+            mask[catalog.index_by_id.get(emoji_id, [])] = True
+        return mask
+    
+    def get_negative_mask(self, catalog):
+        """负缓存中仍未过期的失效地址对应的表情包掩码（顺便清理过期条目）"""
+        now = time.time()
+        expired_urls = [url for url, entry in self.negative_cache.items() if entry["expires_at"] <= now]
+        for url in expired_urls:
+            del self.negative_cache[url]
+        
+        mask = np.zeros(len(catalog), dtype=bool)
+        for url in self.negative_cache:
+            mask[catalog.index_by_url.get(url, [])] = True
+        return mask
+    
+    def is_negatively_cached(self, url):
+        entry = self.negative_cache.get(url)
+        return entry is not None and entry["expires_at"] > time.time()
+    
+    def record_download_failure(self, url, status=None):
+        """记录失效地址：404等永久失效使用长TTL，临时失败的TTL随连续失败次数翻倍"""
+        entry = self.negative_cache.get(url, {"failures": 0})
+        failures = entry["failures"] + 1
+        if status in PERMANENT_FAILURE_STATUSES:
+            ttl = self.negative_cache_ttl
         else:
-            logger.error(f"不支持的数据源类型: {self.emoji_source}")
-            self.emoji_data = []
+            ttl = min(self.negative_cache_ttl, self.negative_cache_transient_ttl * 2 ** (failures - 1))
+        self.negative_cache[url] = {"status": status, "failures": failures, "expires_at": time.time() + ttl}
+        logger.debug(f"记录失效地址: {url} (状态: {status}, {ttl:.0f}s后过期)")
+        self.schedule_cache_save()
+    
+    def schedule_cache_save(self, delay=30):
+        """合并短时间内的多次修改，延迟写入缓存文件"""
+        if self.cache_save_task and not self.cache_save_task.done():
+            return
+        
+        async def delayed_save():
+            await asyncio.sleep(delay)
+            await self.save_cache()
+        
+        self.cache_save_task = asyncio.create_task(delayed_save())
+    
+    def get_local_file_size(self, emoji):
+        """表情包本地文件大小，未下载时返回None"""
+        local_path = emoji.get("local_path")
+        if not local_path:
+            return None
+        try:
+            return os.path.getsize(local_path)
+        except OSError:
+            return None
+    
+    def mark_emoji_available(self, emoji, available=True):
+        """更新表情包在当前目录快照中的本地可用状态"""
+        file_size = (self.get_local_file_size(emoji) or 0) if available else 0
+        catalog = self.catalog
+        catalog.set_available(catalog.index_by_id.get(self.get_emoji_id(emoji), []), available, file_size)
+    
+    def batch_emotion_scores(self, emotions, candidate_mask=None, catalog=None):
+        """批量计算多个情感（多条回复或预下载的各个情感）的表情包得分：情感的one-hot矩阵与得分矩阵相乘
+        
+        返回形状为 (情感数, 表情包数) 的得分矩阵，candidate_mask 为表情包维度的可选掩码
+        """
+        catalog = catalog or self.catalog
+        one_hot = np.zeros((len(emotions), len(self.emotion_labels)), dtype=np.float32)
+        for row, emotion in enumerate(emotions):
+            column = self.emotion_labels.index(emotion) if emotion in self.emotion_labels else self.emotion_labels.index("neutral")
+            one_hot[row, column] = 1.0
         
-        logger.info(f"表情包数据加载完成，共 {len(self.emoji_data)} 个表情包")
+        reply_scores = one_hot @ catalog.emotion_scores.T
+        if candidate_mask is not None:
+            reply_scores *= candidate_mask
+        return reply_scores
+    
+    def get_emoji_search_text(self, emoji):
+        """表情包用于向量检索的文本：去掉扩展名的文件名 + 分类"""
+        name = os.path.splitext(emoji.get("name", ""))[0]
+        return f"{name} {emoji.get('category', '')}".lower()
     
-    def detect_source_type(self, source):
+    def build_vector_index(self, emoji_data, previous_index=None):
+        """构建TF-IDF向量索引，与表情包缓存一起持久化，数据未变化时直接复用"""
+        if self.selection_mode != "vector":
+            return None
+        
+        texts = [self.get_emoji_search_text(emoji) for emoji in emoji_data]
+        fingerprint = EmojiVectorIndex.fingerprint_texts(texts)
+        if previous_index is not None and previous_index.fingerprint == fingerprint:
+            return previous_index
+        
+        index_file = os.path.join(self.emoji_directory, "emoji_vectors.npz")
+        if os.path.exists(index_file):
+            try:
+                cached_index = EmojiVectorIndex.load(index_file)
+                if cached_index.fingerprint == fingerprint:
+                    logger.info(f"从缓存加载向量索引: {len(cached_index.vocabulary)} 个n-gram特征")
+                    return cached_index
+            except Exception as e:
+                logger.warning(f"加载向量索引缓存失败: {e}")
+        
+        start_time = time.time()
+        vector_index = EmojiVectorIndex().fit(texts)
+        logger.info(f"向量索引构建完成: {len(texts)} 个表情包, {len(vector_index.vocabulary)} 个n-gram特征, 耗时 {time.time() - start_time:.2f}s")
+        
+        try:
+            os.makedirs(self.emoji_directory, exist_ok=True)
+            vector_index.save(index_file)
+        except Exception as e:
+            logger.warning(f"保存向量索引失败: {e}")
+        return vector_index
+    
+    def get_source_id(self, source):
+        """数据源的稳定短ID，用于区分各数据源的表情包和缓存分区"""
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()[:8]
+    
+    def detect_source_type(self, source, cached_section=None):
         """智能检测数据源类型"""
-        if not source:
-            return "cached"  # 空配置优先使用缓存
-            
         if source.startswith(("http://", "https://")):
             return "url"
         elif source.endswith(".json") and os.path.isfile(source):
             return "json_file"
         elif os.path.isdir(source):
             return "directory"
+        elif cached_section:
+            return "cached"
         else:
-            # 检查是否有缓存
-            cache_file = os.path.join(self.emoji_directory, "emoji_cache.json")
-            if os.path.exists(cache_file):
-                return "cached"
-            else:
-                return "url"  # 默认当作URL处理
+            return "url"  # 默认当作URL处理
+    
+    async def load_source(self, source, cached_section=None):
+        """加载单个数据源，返回该数据源的缓存分区，失败时回退到该数据源的缓存"""
+        source_type = self.detect_source_type(source, cached_section)
+        logger.info(f"检测到数据源类型: {source_type} ({source})")
+        
+        if source_type == "url":
+            return await self.load_from_url(source, cached_section)
+        elif source_type == "json_file":
+            return await self.load_from_json_file(source, cached_section)
+        elif source_type == "directory":
+            return await self.load_from_directory(source, cached_section)
+        elif source_type == "cached":
+            logger.info(f"数据源不可访问，使用缓存: {source}")
+            return cached_section
+        
+        logger.error(f"不支持的数据源类型: {source}")
+        return None
+    
+    def is_emoji_included(self, emoji, anime_categories):
+        """按分类白名单、黑名单和仅二次元模式判断表情包是否保留"""
+        category = emoji.get("category", "").lower()
+        if self.category_allowlist and not any(keyword in category for keyword in self.category_allowlist):
+            return False
+        if self.category_denylist and any(keyword in category for keyword in self.category_denylist):
+            return False
+        if self.anime_only and not self.is_anime_emoji(emoji.get("name", ""), category, anime_categories):
+            return False
+        return True
+    
+    def has_category_filter(self):
+        return bool(self.category_allowlist or self.category_denylist or self.anime_only)
     
+    def section_matches_filter(self, section):
+        """缓存分区是否按当前的分类筛选条件生成（旧版缓存没有记录，视为未筛选）"""
+        return section.get("category_filter", UNFILTERED_CATEGORY_KEY) == self.category_filter_key
+    
+    def filter_cached_section(self, section):
+        """缓存分区的筛选条件与当前配置不一致时（例如回退到旧缓存）按当前条件重新筛选
+        
+        重新筛选的分区不记录筛选条件，之后任何条件下都不会被当作完整数据复用，下次成功加载时重新获取
+        """
+        if self.section_matches_filter(section) or not self.has_category_filter():
+            return section
+        anime_categories = self.get_anime_categories()
+        filtered = [emoji for emoji in section.get("data", []) if self.is_emoji_included(emoji, anime_categories)]
+        logger.info(f"按当前分类筛选条件重新筛选缓存: {len(section.get('data', []))} → {len(filtered)} 个表情包 ({section.get('source')})")
+        return {**section, "category_filter": None, "data": filtered}
+    
+    def make_source_section(self, source, source_type, emoji_list, **extra):
+        """创建数据源缓存分区"""
+        source_id = self.get_source_id(source)
+        for emoji in emoji_list:
+            emoji["source_id"] = source_id
+        section = {
+            "source": source,
+            "type": source_type,
+            "updated_at": time.time(),
+            "category_filter": self.category_filter_key,
+            "data": emoji_list,
+        }
+        section.update(extra)
+        return section
+    
+    def merge_source_sections(self, sections):
+        """按数据源配置顺序合并各分区，相同地址的表情包只保留优先级最高的一个"""
+        merged = []
+        seen_keys = set()
+        duplicate_count = 0
+        for source in self.emoji_sources:
+            section = sections.get(self.get_source_id(source))
+            if not section:
+                continue
+            for emoji in section.get("data", []):
+                dedup_key = emoji.get("url") or emoji.get("local_path") or self.get_emoji_id(emoji)
+                if dedup_key in seen_keys:
+                    duplicate_count += 1
+                    continue
+                seen_keys.add(dedup_key)
+                merged.append(emoji)
+        
+        if duplicate_count:
+            logger.info(f"合并数据源时去除了 {duplicate_count} 个重复表情包")
+        return merged
     
     async def load_from_cache(self):
-        """从缓存加载"""
+        """从缓存加载各数据源的分区，返回 {数据源ID: 分区}（在线程池中读取）
+        
+        缓存中的失效地址和使用时间与内存中的合并，失效地址取较晚的过期时间、使用时间取较新的；
+        重新加载时内存中可能有尚未保存的记录
+        """
+        loop = asyncio.get_running_loop()
+        restored = {}
+        sections = await loop.run_in_executor(None, self.read_cache_file, restored)
+        now = time.time()
+        for url, entry in restored.get("negative_cache", {}).items():
+            current = self.negative_cache.get(url)
+            if entry.get("expires_at", 0) > now and (current is None or entry["expires_at"] > current["expires_at"]):
+                self.negative_cache[url] = entry
+        for emoji_id, used_at in restored.get("last_used", {}).items():
+            if used_at > self.last_used_at.get(emoji_id, 0):
+                self.last_used_at[emoji_id] = used_at
+        return sections
+    
+    def read_cache_file(self, restored):
+        """读取缓存文件（在线程池中执行），返回数据源分区；失效地址和使用时间写入restored，由调用方合并"""
         try:
             cache_file = os.path.join(self.emoji_directory, "emoji_cache.json")
             if not os.path.exists(cache_file):
-                return False
+                return {}
                 
             with open(cache_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-                
-            # 处理新的缓存格式 {"data": [...], "cache_info": {...}} 或旧格式 [...]
-            emoji_list = []
-            if isinstance(data, dict) and "data" in data:
-                # 新格式：包含完整信息的缓存
-                emoji_list = data["data"]
-                cache_info = data.get("cache_info", {})
-                logger.info(f"加载缓存信息: 总计{cache_info.get('total_count', 0)}个表情包")
-            elif isinstance(data, list):
-                # 旧格式：直接是表情包数组
-                emoji_list = data
             
-            if len(emoji_list) > 0:
-                # 更新local_path以确保一致性
+            if isinstance(data, dict):
+                restored["negative_cache"] = data.get("negative_cache", {})
+                restored["last_used"] = data.get("last_used", {})
+            
+            if isinstance(data, dict) and "sources" in data:
+                # 多数据源格式：{"sources": {数据源ID: 分区}, "cache_info": {...}}
+                sections = data["sources"]
+                cache_info = data.get("cache_info", {})
+                logger.info(f"加载缓存信息: 总计{cache_info.get('total_count', 0)}个表情包, {len(sections)}个数据源分区")
+            else:
+                # 处理旧的缓存格式 {"data": [...], "cache_info": {...}} 或 [...]，视为第一个数据源的缓存
+                emoji_list = []
+                if isinstance(data, dict) and "data" in data:
+                    emoji_list = data["data"]
+                elif isinstance(data, list):
+                    emoji_list = data
+                if not emoji_list:
+                    return {}
+                
+                source = self.emoji_sources[0]
                 for emoji in emoji_list:
                     if "local_path" not in emoji:
                         emoji["local_path"] = self.generate_local_path(emoji)
-                
-                # 验证本地文件是否存在的表情包
-                valid_emojis = []
-                for emoji in emoji_list:
-                    local_path = emoji.get("local_path")
-                    if local_path and os.path.exists(local_path):
-                        valid_emojis.append(emoji)
-                
-                # 加载所有数据（包括未下载的），但统计本地可用数量
-                self.emoji_data = emoji_list
-                logger.info(f"从缓存加载了 {len(emoji_list)} 个表情包，其中 {len(valid_emojis)} 个本地可用")
-                return True
-            return False
+                section = self.make_source_section(source, "cached", emoji_list)
+                section["updated_at"] = 0  # 旧缓存没有条件请求信息，下次加载时会重新拉取
+                sections = {self.get_source_id(source): section}
+            
+            # 统计本地可用数量
+            total_count = sum(len(section.get("data", [])) for section in sections.values())
+            local_count = sum(1 for section in sections.values() for emoji in section.get("data", [])
+                              if emoji.get("local_path") and os.path.exists(emoji["local_path"]))
+            logger.info(f"从缓存加载了 {total_count} 个表情包，其中 {local_count} 个本地可用")
+            return sections
         except Exception as e:
             logger.warning(f"加载缓存失败: {e}")
-            return False
+            return {}
     
-    async def load_from_url(self):
-        """从网络URL加载JSON数据"""
+    async def load_from_url(self, source, cached_section=None):
+        """从网络URL加载JSON数据，利用ETag/Last-Modified条件请求，未变化时直接复用缓存分区"""
         timeout = aiohttp.ClientTimeout(total=self.request_timeout)
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
         
+        # 只有来自该URL且筛选条件相同的缓存分区才能用于条件请求
+        if (cached_section and cached_section.get("type") == "url"
+                and self.section_matches_filter(cached_section)):
+            if cached_section.get("etag"):
+                headers["If-None-Match"] = cached_section["etag"]
+            if cached_section.get("last_modified"):
+                headers["If-Modified-Since"] = cached_section["last_modified"]
+        
         connector = aiohttp.TCPConnector(
             ssl=False,
-            limit=10,
+            limit=max(10, len(self.download_mirrors)),
             ttl_dns_cache=300,
             use_dns_cache=True,
         )
         
         async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as session:
-            logger.info(f"正在请求: {self.emoji_source}")
+            logger.info(f"正在请求: {source}")
             
             try:
-                async with session.get(self.emoji_source) as response:
+                response, first_chunk, mirror = await self.open_with_mirrors(session, source, ok_statuses=(200, 304))
+                async with response:
+                    if response.status == 304 and cached_section:
+                        logger.info(f"数据源未变化，复用缓存: {source}")
+                        return cached_section
+                    
                     if response.status == 200:
-                        response_text = await response.text()
+                        response_text = (first_chunk + await response.read()).decode(response.get_encoding())
                         json_data = json.loads(response_text)
                         
                         if isinstance(json_data, dict) and "data" in json_data:
@@ -177,11 +1694,16 @@ class LetAISendEmojisPlugin(Star):
                         elif isinstance(json_data, list):
                             emoji_list = json_data
                         else:
-                            logger.error("不支持的JSON格式")
-                            return
+                            raise ValueError("不支持的JSON格式")
                         
-                        self.emoji_data = []
+                        source_id = self.get_source_id(source)
+                        anime_categories = self.get_anime_categories()
+                        emoji_items = []
                         for emoji in emoji_list:
+                            # 被分类筛选排除的表情包不复制、不进入缓存
+                            if not self.is_emoji_included(emoji, anime_categories):
+                                continue
+                            
                             # 保留原始JSON的所有字段
                             emoji_item = emoji.copy()
                             
@@ -191,31 +1713,39 @@ class LetAISendEmojisPlugin(Star):
                                 emoji_item["url"] = f"https://raw.githubusercontent.com/zhaoolee/ChineseBQB/master/{original_url.lstrip('./')}"
                             
                             # 添加本地路径字段（额外信息，不替换原有信息）
-                            emoji_item["local_path"] = self.generate_local_path(emoji)
+                            emoji_item["local_path"] = self.generate_local_path(emoji, source_id)
                             
-                            self.emoji_data.append(emoji_item)
-                        
-                        logger.info(f"成功加载了 {len(self.emoji_data)} 个表情包")
+                            emoji_items.append(emoji_item)
                         
-                        await self.save_cache()
+                        logger.info(f"成功加载了 {len(emoji_items)}/{len(emoji_list)} 个表情包: {source}")
                         # 不再预先批量下载，改为按需下载
-                        logger.info("表情包数据已加载，将采用按需下载模式")
-                        
+                        return self.make_source_section(
+                            source, "url", emoji_items,
+                            etag=response.headers.get("ETag"),
+                            last_modified=response.headers.get("Last-Modified"),
+                        )
                     else:
-                        logger.error(f"HTTP响应错误: {response.status}")
+                        logger.error(f"HTTP响应错误: {response.status} ({source})")
                         
             except Exception as e:
-                logger.error(f"网络请求失败: {e}")
-                logger.info("尝试使用缓存数据...")
-                if await self.load_from_cache():
-                    logger.info("成功使用缓存数据")
-                else:
-                    logger.warning("无可用的表情包数据")
+                logger.error(f"网络请求失败: {source} - {e}")
+        
+        if cached_section:
+            logger.info(f"使用缓存数据: {source}")
+            return cached_section
+        logger.warning(f"无可用的表情包数据: {source}")
+        return None
     
-    async def load_from_json_file(self):
-        """从本地JSON文件加载"""
+    async def load_from_json_file(self, source, cached_section=None):
+        """从本地JSON文件加载，文件未修改时直接复用缓存分区"""
         try:
-            with open(self.emoji_source, 'r', encoding='utf-8') as f:
+            mtime = os.path.getmtime(source)
+            if (cached_section and cached_section.get("type") == "json_file" and cached_section.get("mtime") == mtime
+                    and self.section_matches_filter(cached_section)):
+                logger.info(f"JSON文件未变化，复用缓存: {source}")
+                return cached_section
+            
+            with open(source, 'r', encoding='utf-8') as f:
                 json_data = json.load(f)
             
             # 处理不同JSON格式
@@ -224,90 +1754,459 @@ class LetAISendEmojisPlugin(Star):
             elif isinstance(json_data, list):
                 emoji_list = json_data
             else:
-                logger.error("不支持的JSON格式")
-                return
+                raise ValueError("不支持的JSON格式")
             
-            self.emoji_data = []
+            source_id = self.get_source_id(source)
+            anime_categories = self.get_anime_categories()
+            emoji_items = []
             for emoji in emoji_list:
+                if not self.is_emoji_included(emoji, anime_categories):
+                    continue
+                
                 # 保留原始JSON的所有字段
                 emoji_item = emoji.copy()
                 
                 # 如果没有local_path则生成（额外添加，不替换原有信息）
                 if "local_path" not in emoji_item:
-                    emoji_item["local_path"] = self.generate_local_path(emoji)
+                    emoji_item["local_path"] = self.generate_local_path(emoji, source_id)
                     
-                self.emoji_data.append(emoji_item)
+                emoji_items.append(emoji_item)
             
-            logger.info(f"从JSON文件加载了 {len(self.emoji_data)} 个表情包")
+            logger.info(f"从JSON文件加载了 {len(emoji_items)}/{len(emoji_list)} 个表情包: {source}")
+            return self.make_source_section(source, "json_file", emoji_items, mtime=mtime)
             
         except Exception as e:
-            logger.error(f"从JSON文件加载失败: {e}")
+            logger.error(f"从JSON文件加载失败: {source} - {e}")
+            return cached_section
     
-    async def load_from_directory(self):
+    async def load_from_directory(self, source, cached_section=None):
         """从本地目录扫描表情包文件"""
         try:
             emoji_files = []
             supported_formats = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+            anime_categories = self.get_anime_categories()
             
-            for root, dirs, files in os.walk(self.emoji_source):
+            for root, dirs, files in os.walk(source):
                 for file in files:
                     if any(file.lower().endswith(fmt) for fmt in supported_formats):
                         file_path = os.path.join(root, file)
-                        relative_path = os.path.relpath(file_path, self.emoji_source)
+                        relative_path = os.path.relpath(file_path, source)
                         
                         # 从目录结构推断分类
                         category = os.path.dirname(relative_path) if os.path.dirname(relative_path) else "其他"
                         
-                        emoji_files.append({
+                        emoji = {
                             "name": file,
                             "category": category,
                             "url": f"file://{file_path}",
                             "local_path": file_path
-                        })
+                        }
+                        if self.is_emoji_included(emoji, anime_categories):
+                            emoji_files.append(emoji)
             
-            self.emoji_data = emoji_files
-            logger.info(f"从目录扫描了 {len(self.emoji_data)} 个表情包文件")
+            logger.info(f"从目录扫描了 {len(emoji_files)} 个表情包文件: {source}")
+            
+            # 文件列表和筛选条件没有变化时复用缓存分区，避免重写缓存
+            if cached_section and self.section_matches_filter(cached_section) \
+                    and [emoji.get("local_path") for emoji in cached_section.get("data", [])] == [emoji["local_path"] for emoji in emoji_files]:
+                return cached_section
+            return self.make_source_section(source, "directory", emoji_files)
             
         except Exception as e:
-            logger.error(f"从目录加载失败: {e}")
+            logger.error(f"从目录加载失败: {source} - {e}")
+            return cached_section
     
-    def generate_local_path(self, emoji):
+    def generate_local_path(self, emoji, source_id=None):
         name = emoji.get("name", "")
         category = emoji.get("category", "其他")
         
         if not name:
             return ""
-            
-        category_dir = os.path.join(self.emoji_directory, category)
+        
+        # 第一个数据源沿用原有目录结构，其他数据源按数据源ID分目录存储，避免同名文件冲突
+        if source_id and source_id != self.get_source_id(self.emoji_sources[0]):
+            category_dir = os.path.join(self.emoji_directory, "sources", source_id, category)
+        else:
+            category_dir = os.path.join(self.emoji_directory, category)
         return os.path.join(category_dir, name)
     
     
     async def save_cache(self):
-        """保存缓存，格式仿造ChineseBQB的JSON结构"""
+        """保存缓存，每个数据源一个分区，分区内格式仿造ChineseBQB的JSON结构"""
         try:
             cache_file = os.path.join(self.emoji_directory, "emoji_cache.json")
             
-            # 创建仿造ChineseBQB格式的缓存数据
+            # 复制一份交给线程池合并，其他进程的分区不会混入本进程的数据源状态；只有本进程配置的数据源更新保存时间
+            own_source_ids = {self.get_source_id(source) for source in self.emoji_sources}
             cache_data = {
-                "data": self.emoji_data,
+                "sources": dict(self.source_sections),
+                "section_saved_at": dict.fromkeys((source_id for source_id in self.source_sections if source_id in own_source_ids), time.time()),
+                "negative_cache": {url: entry for url, entry in self.negative_cache.items() if entry["expires_at"] > time.time()},
+                "last_used": dict(self.last_used_at),
                 "cache_info": {
-                    "total_count": len(self.emoji_data),
-                    "local_available": sum(1 for emoji in self.emoji_data 
-                                         if emoji.get("local_path") and os.path.exists(emoji.get("local_path", ""))),
+                    "total_count": len(self.catalog),
+                    "local_available": self.catalog.available_count,
                     "last_updated": json.dumps({"timestamp": "auto-generated"}, ensure_ascii=False),
                     "source": "AstrBot LetAI SendEmojis Plugin"
                 }
             }
             
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            # 多个进程共享缓存文件：加锁后与文件中的内容合并，在线程池中写入
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.write_cache_file, cache_file, cache_data)
+            self.usage_dirty = False
                 
-            logger.info(f"缓存已保存: {cache_file} (包含完整的表情包信息)")
+            logger.info(f"缓存已保存: {cache_file} (包含 {len(self.source_sections)} 个数据源分区)")
             logger.info(f"缓存统计: 总计{cache_data['cache_info']['total_count']}个, 本地可用{cache_data['cache_info']['local_available']}个")
             
         except Exception as e:
             logger.warning(f"保存缓存失败: {e}")
     
+    def write_cache_file(self, cache_file, cache_data):
+        """持有文件锁写入缓存（在线程池中执行）
+        
+        保留其他进程写入的数据源分区（超过保留时间未被任何进程写入的分区移除），负缓存取较晚的过期时间、
+        使用时间取较新的，先写临时文件再原子替换，读取方无需加锁
+        """
+        with FileLock(cache_file + ".lock", timeout=30):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    existing = json.load(f)
+            except (OSError, ValueError):
+                existing = {}
+            
+            if isinstance(existing, dict):
+                if isinstance(existing.get("sources"), dict):
+                    saved_at = existing.get("section_saved_at", {})
+                    retain_after = time.time() - SOURCE_SECTION_RETENTION
+                    for source_id, section in existing["sources"].items():
+                        if source_id not in cache_data["sources"] and saved_at.get(source_id, 0) > retain_after:
+                            cache_data["sources"][source_id] = section
+                            cache_data["section_saved_at"][source_id] = saved_at[source_id]
+                for url, entry in existing.get("negative_cache", {}).items():
+                    current = cache_data["negative_cache"].get(url)
+                    if entry.get("expires_at", 0) > time.time() and (current is None or entry["expires_at"] > current["expires_at"]):
+                        cache_data["negative_cache"][url] = entry
+                last_used = dict(existing.get("last_used", {}))
+                for emoji_id, used_at in cache_data["last_used"].items():
+                    last_used[emoji_id] = max(used_at, last_used.get(emoji_id, 0))
+                cache_data["last_used"] = last_used
+            
+            temp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(cache_data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, cache_file)
+    
+    def get_integrity_state_file(self):
+        return os.path.join(self.emoji_directory, "integrity_state.json")
+    
+    def load_integrity_state(self):
+        """已校验通过的文件 {相对路径: [大小, 修改时间ns]}"""
+        try:
+            with open(self.get_integrity_state_file(), 'r', encoding='utf-8') as f:
+                return json.load(f).get("files", {})
+        except (OSError, ValueError, AttributeError):
+            return {}
+    
+    def save_integrity_state(self, files):
+        state_file = self.get_integrity_state_file()
+        temp_file = f"{state_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({"files": files}, f, ensure_ascii=False)
+        os.replace(temp_file, state_file)
+    
+    async def run_integrity_scan(self):
+        """并行检查所有本地可用表情包文件，隔离损坏的文件并更新可用状态，返回检查结果统计
+        
+        大小和修改时间与上次校验通过时一致的文件直接跳过
+        """
+        start_time = time.monotonic()
+        catalog = self.catalog
+        # 只检查插件下载的文件，本地目录数据源中用户自己的文件不做隔离
+        store_prefix = os.path.join(self.emoji_directory, "")
+        paths = sorted({catalog.emoji_data[index]["local_path"] for index in np.flatnonzero(catalog.available_mask)
+                        if catalog.emoji_data[index]["local_path"].startswith(store_prefix)})
+        loop = asyncio.get_running_loop()
+        verified = await loop.run_in_executor(None, self.load_integrity_state)
+        
+        # 分块提交到专用线程池，块数多于线程数使各线程负载均衡
+        chunk_size = max(1, math.ceil(len(paths) / (self.integrity_scan_workers * 4)))
+        chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+        pool = ThreadPoolExecutor(max_workers=self.integrity_scan_workers, thread_name_prefix="emoji-verify")
+        try:
+            results = await asyncio.gather(*(loop.run_in_executor(pool, self.verify_local_files, chunk, verified) for chunk in chunks))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        
+        summary = Counter()
+        files = {}
+        for path, status, detail in (item for chunk_results in results for item in chunk_results):
+            summary[status] += 1
+            if status in ("ok", "cached"):
+                files[os.path.relpath(path, self.emoji_directory)] = detail
+                continue
+            # 损坏或已不存在的文件标记为不可用，下次需要时重新下载
+            current = self.catalog
+            current.set_available(current.index_by_path.get(os.path.normpath(path), []), False)
+            if status == "bad":
+                logger.warning(f"表情包文件损坏，已隔离: {path} ({detail})")
+                self.append_store_journal(path, False)
+        await loop.run_in_executor(None, self.save_integrity_state, files)
+        
+        self.integrity_summary = dict(summary, seconds=time.monotonic() - start_time, finished_at=time.time())
+        logger.info(f"本地表情包完整性检查完成: 共{len(paths)}个, 校验{summary['ok'] + summary['bad']}个, 跳过{summary['cached']}个, "
+                    f"隔离{summary['bad']}个, 缺失{summary['missing']}个, 耗时{self.integrity_summary['seconds']:.2f}s")
+        return self.integrity_summary
+    
+    def verify_local_files(self, paths, verified):
+        """校验一组本地文件（在线程池中执行），返回 [(路径, 状态, 详情)]
+        
+        状态: cached(未变化，跳过) ok(校验通过) bad(损坏，已隔离) missing(文件不存在)
+        """
+        results = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                results.append((path, "missing", None))
+                continue
+            state = [stat.st_size, stat.st_mtime_ns]
+            if verified.get(os.path.relpath(path, self.emoji_directory)) == state:
+                results.append((path, "cached", state))
+                continue
+            try:
+                problem = check_image_file(path, stat.st_size)
+            except OSError as e:
+                problem = f"读取失败: {e}"
+            if problem is None:
+                results.append((path, "ok", state))
+            else:
+                self.quarantine_file(path)
+                results.append((path, "bad", problem))
+        return results
+    
+    def quarantine_file(self, path):
+        """把损坏的文件移入 emojis/.quarantine，保留相对路径，便于人工检查"""
+        target = os.path.join(self.emoji_directory, ".quarantine", os.path.relpath(path, self.emoji_directory))
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        except OSError as e:
+            logger.warning(f"隔离损坏文件失败，直接删除: {path} - {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def get_usage_log_file(self):
+        return os.path.join(self.emoji_directory, "usage_log.jsonl")
+    
+    def get_usage_stats_file(self):
+        return os.path.join(self.emoji_directory, "usage_stats.json")
+    
+    def record_usage(self, emoji, session_id, emotion):
+        """记录一次表情包发送：立即更新内存中的热度计数，日志在缓冲一段时间后批量写入"""
+        emoji_id = self.get_emoji_id(emoji)
+        now = time.time()
+        self.usage_stats.record(emoji_id, emotion, now)
+        self.usage_pending.append({"t": round(now, 1), "id": emoji_id, "s": session_id, "e": emotion})
+        if self.usage_flush_task is None or self.usage_flush_task.done():
+            self.usage_flush_task = asyncio.create_task(self.delayed_usage_flush())
+    
+    async def delayed_usage_flush(self):
+        await asyncio.sleep(USAGE_FLUSH_DELAY)
+        await self.flush_usage_log()
+    
+    async def flush_usage_log(self):
+        """在线程池中把缓冲的发送记录追加到使用日志"""
+        if not self.usage_pending:
+            return
+        records, self.usage_pending = self.usage_pending, []
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.append_usage_log, records)
+        except Exception as e:
+            logger.warning(f"写入使用日志失败: {e}")
+            self.usage_pending = records + self.usage_pending
+    
+    def append_usage_log(self, records):
+        """追加使用日志（在线程池中执行），日志超过大小限制时合并进热度计数文件"""
+        log_file = self.get_usage_log_file()
+        os.makedirs(self.emoji_directory, exist_ok=True)
+        with FileLock(log_file + ".lock", timeout=30):
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            if os.path.getsize(log_file) > USAGE_LOG_COMPACT_BYTES:
+                self.compact_usage_log_locked()
+    
+    async def load_usage_stats(self):
+        """启动时合并使用日志并加载热度计数（包括共享插件目录的其他进程写入的记录）"""
+        try:
+            loop = asyncio.get_running_loop()
+            self.usage_stats = await loop.run_in_executor(None, self.compact_usage_log)
+            logger.info(f"已加载使用热度: {len(self.usage_stats.emojis)} 个表情包, {len(self.usage_stats.emotions)} 种情感")
+        except Exception as e:
+            logger.warning(f"加载使用热度失败: {e}")
+    
+    def compact_usage_log(self):
+        os.makedirs(self.emoji_directory, exist_ok=True)
+        with FileLock(self.get_usage_log_file() + ".lock", timeout=30):
+            return self.compact_usage_log_locked()
+    
+    def compact_usage_log_locked(self):
+        """把使用日志合并进热度计数文件并清空日志，返回合并后的UsageStats（需持有日志锁）"""
+        stats_file = self.get_usage_stats_file()
+        log_file = self.get_usage_log_file()
+        try:
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                stats = UsageStats.from_dict(json.load(f), self.usage_half_life)
+        except (OSError, ValueError):
+            stats = UsageStats(self.usage_half_life)
+        
+        try:
+            with open(log_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("id"):
+                        stats.record(record["id"], record.get("e"), record.get("t", 0))
+        except OSError:
+            pass
+        
+        stats.prune()
+        temp_file = f"{stats_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(stats.to_dict(), f, ensure_ascii=False)
+        os.replace(temp_file, stats_file)
+        open(log_file, 'w').close()
+        return stats
+    
+    def get_store_journal_file(self, generation):
+        return os.path.join(self.emoji_directory, f"store_journal.{generation}.log")
+    
+    def list_store_journal_generations(self):
+        """存储日志目录中现有的日志代数，从小到大"""
+        try:
+            names = os.listdir(self.emoji_directory)
+        except OSError:
+            return []
+        return sorted(int(match.group(1)) for match in map(STORE_JOURNAL_PATTERN.match, names) if match)
+    
+    def get_store_journal_end(self):
+        """当前日志的末尾位置 (代数, 字节数)，启动时从这里开始同步"""
+        generations = self.list_store_journal_generations()
+        generation = generations[-1] if generations else 0
+        try:
+            return generation, os.path.getsize(self.get_store_journal_file(generation))
+        except OSError:
+            return generation, 0
+    
+    def append_store_journal(self, local_path, available, size=0):
+        """记录本地文件的下载/删除，供共享插件目录的其他进程同步；文件写入在线程池中按顺序进行"""
+        self.store_journal_pending.append(json.dumps({
+            "path": os.path.relpath(local_path, self.emoji_directory),
+            "available": available,
+            "size": size,
+        }, ensure_ascii=False))
+        if self.store_journal_task is None or self.store_journal_task.done():
+            self.store_journal_task = asyncio.create_task(self.flush_store_journal())
+    
+    async def flush_store_journal(self):
+        loop = asyncio.get_running_loop()
+        while self.store_journal_pending:
+            records, self.store_journal_pending = self.store_journal_pending, []
+            await loop.run_in_executor(None, self.write_store_journal, records)
+    
+    def write_store_journal(self, records):
+        """追加存储日志记录（在线程池中执行）
+        
+        追加模式下单次写入是原子的，无需加锁；日志过大时加锁轮换到下一代文件而不截断，
+        其他进程读完旧文件后再切换到新文件，已保存的读取位置不会失效
+        """
+        try:
+            generations = self.list_store_journal_generations()
+            generation = generations[-1] if generations else 0
+            journal_file = self.get_store_journal_file(generation)
+            if os.path.exists(journal_file) and os.path.getsize(journal_file) > STORE_JOURNAL_ROTATE_BYTES:
+                with FileLock(os.path.join(self.emoji_directory, "store_journal.lock"), timeout=5):
+                    generations = self.list_store_journal_generations()
+                    generation = generations[-1] if generations else 0
+                    journal_file = self.get_store_journal_file(generation)
+                    if os.path.getsize(journal_file) > STORE_JOURNAL_ROTATE_BYTES:
+                        generation += 1
+                        journal_file = self.get_store_journal_file(generation)
+                        open(journal_file, 'a').close()
+                        # 保留上一代日志供尚未读完的进程读取，更早的删除
+                        for old_generation in generations:
+                            if old_generation < generation - 1:
+                                os.remove(self.get_store_journal_file(old_generation))
+            with open(journal_file, 'a', encoding='utf-8') as f:
+                f.write("".join(record + "\n" for record in records))
+        except (OSError, Timeout) as e:
+            logger.debug(f"写入存储日志失败: {e}")
+    
+    def read_store_journal(self, position):
+        """读取存储日志中position之后的新记录（在线程池中执行），返回 (记录列表, 新position)
+        
+        position为 (代数, 字节数)；读完旧一代的日志后切换到下一代，从头读取
+        """
+        generation, offset = position
+        generations = self.list_store_journal_generations()
+        latest = generations[-1] if generations else 0
+        if generation > latest:
+            generation, offset = latest, 0  # 日志目录被清空后重新开始
+        
+        records = []
+        while True:
+            try:
+                with open(self.get_store_journal_file(generation), 'rb') as f:
+                    if os.fstat(f.fileno()).st_size < offset:
+                        offset = 0  # 日志文件被替换
+                    f.seek(offset)
+                    content = f.read()
+            except OSError:
+                content = b""
+            # 只处理完整的行，末尾未写完的部分留到下次读取
+            complete = content[:content.rfind(b"\n") + 1]
+            for line in complete.decode('utf-8', errors='ignore').splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+            offset += len(complete)
+            if generation >= latest:
+                return records, (generation, offset)
+            generation, offset = generation + 1, 0
+    
+    async def sync_shared_store(self):
+        """应用其他进程写入的存储日志，更新本地可用状态，返回更新的文件数"""
+        loop = asyncio.get_running_loop()
+        records, self.store_journal_position = await loop.run_in_executor(None, self.read_store_journal, self.store_journal_position)
+        
+        catalog = self.catalog
+        updated = 0
+        for record in records:
+            local_path = os.path.normpath(os.path.join(self.emoji_directory, record.get("path", "")))
+            indices = catalog.index_by_path.get(local_path)
+            if not indices or bool(catalog.available_mask[indices[0]]) == record.get("available"):
+                continue
+            catalog.set_available(indices, record.get("available"), record.get("size", 0))
+            updated += 1
+        if updated:
+            logger.info(f"从共享存储同步了 {updated} 个表情包的本地状态")
+        return updated
+    
+    async def watch_shared_store(self):
+        """定期同步共享插件目录中其他进程的下载和清理结果"""
+        while True:
+            await asyncio.sleep(self.store_sync_interval)
+            try:
+                await self.sync_shared_store()
+            except Exception as e:
+                logger.warning(f"同步共享存储失败: {e}")
+    
     # 已移除批量下载逻辑，改为按需下载模式
     
     @filter.command("测试表情包下载", "test_emoji_download")
@@ -331,70 +2230,486 @@ class LetAISendEmojisPlugin(Star):
     @filter.command("查看缓存信息", "check_cache_info")
     async def check_cache_info(self, event: AstrMessageEvent):
         """查看表情包缓存信息"""
-        cache_file = os.path.join(self.emoji_directory, "emoji_cache.json")
+        if not self.source_sections:
+            return event.plain_result("❌ 表情包数据为空，没有可用的缓存")
         
-        if not os.path.exists(cache_file):
-            return event.plain_result("❌ 缓存文件不存在")
+        catalog = self.catalog
+        total = len(catalog)
+        local = catalog.available_count
         
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            if isinstance(data, dict) and "cache_info" in data:
-                cache_info = data["cache_info"]
-                total = cache_info.get("total_count", 0)
-                local = cache_info.get("local_available", 0)
-                source = cache_info.get("source", "未知")
-                
-                info_text = f"""表情包缓存信息:
+        source_lines = ""
+        for section in self.source_sections.values():
+            updated_at = section.get("updated_at") or 0
+            updated_text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(updated_at)) if updated_at else "未知"
+            source_lines += f"\n- {section.get('source')}: {len(section.get('data', []))} 个 (更新于 {updated_text})"
+        
+        info_text = f"""表情包缓存信息:
                 
 总计: {total} 个表情包
-本地可用: {local} 个
-下载率: {(local/total*100):.1f}% 
-数据源: {source}
+本地可用: {local} 个 ({self.format_bytes(catalog.bytes_on_disk)})
+下载率: {(local/total*100 if total else 0):.1f}% 
+数据源: AstrBot LetAI SendEmojis Plugin
 缓存文件: emoji_cache.json
 
+数据源分区:{source_lines or " 无"}
+
 插件采用按需下载模式：
 - 优先使用本地已下载的表情包
 - 找不到合适的时，从数据源搜索二次元表情包并立即下载
 - 按分类自动存储到本地目录
 - 逐步建立精准的本地表情包库"""
-                
-                return event.plain_result(info_text)
-            else:
-                return event.plain_result("⚠️ 旧格式缓存文件，建议重新加载插件更新格式")
-                
+        
+        return event.plain_result(info_text)
+    
+    @staticmethod
+    def format_bytes(size):
+        """字节数转为易读的文本"""
+        for unit in ("B", "KB", "MB"):
+            if size < 1024:
+                return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+            size /= 1024
+        return f"{size:.1f}GB"
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("重新加载表情包", "reload_emojis")
+    async def reload_emojis_command(self, event: AstrMessageEvent):
+        """重新读取配置和数据源，增量更新表情包目录（无需重启）"""
+        if self.reload_lock.locked():
+            return event.plain_result("⚠️ 正在重新加载中，请稍后再试")
+        
+        try:
+            start_time = time.time()
+            previous_count, current_count = await self.reload_emoji_data(reload_config=True)
+            return event.plain_result(f"""✅ 表情包数据已重新加载
+📦 表情包数量: {previous_count} → {current_count}
+🔄 新增 {self.catalog_diff['added']}，删除 {self.catalog_diff['removed']}，变更 {self.catalog_diff['changed']}，复用 {self.catalog_diff['reused']}
+🗂️ 数据源: {len(self.source_sections)}/{len(self.emoji_sources)} 个可用
+⏱️ 耗时: {time.time() - start_time:.2f}s""")
+        except Exception as e:
+            logger.error(f"重新加载表情包失败: {e}")
+            return event.plain_result(f"❌ 重新加载失败: {e}")
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("检查表情包完整性", "verify_emojis")
+    async def verify_emojis_command(self, event: AstrMessageEvent):
+        """检查本地表情包文件是否完整，隔离损坏的文件"""
+        if self.integrity_task and not self.integrity_task.done():
+            return event.plain_result("⚠️ 完整性检查正在进行中，请稍后再试")
+        
+        self.integrity_task = asyncio.create_task(self.run_integrity_scan())
+        try:
+            summary = await self.integrity_task
         except Exception as e:
-            return event.plain_result(f"❌ 读取缓存失败: {e}")
+            logger.error(f"完整性检查失败: {e}")
+            return event.plain_result(f"❌ 完整性检查失败: {e}")
+        return event.plain_result(f"""✅ 完整性检查完成
+🔍 校验 {summary.get('ok', 0) + summary.get('bad', 0)} 个，未变化跳过 {summary.get('cached', 0)} 个
+🚫 隔离损坏文件 {summary.get('bad', 0)} 个，文件缺失 {summary.get('missing', 0)} 个
+⏱️ 耗时: {summary['seconds']:.2f}s""")
     
+    @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("清理本地表情包", "clear_local_emojis")
     async def clear_local_emojis_command(self, event: AstrMessageEvent):
-        """清理本地下载的表情包文件"""
+        """按筛选条件清理本地下载的表情包文件（保留缓存和索引文件）"""
+        if self.cleanup_lock.locked():
+            return event.plain_result("⚠️ 正在清理中，请稍后再试")
+        
+        filter_text = " ".join(event.get_message_str().split()[1:])
         try:
-            import shutil
-            
-            if os.path.exists(self.emoji_directory):
-                # 统计删除的文件数量
-                file_count = 0
-                for root, dirs, files in os.walk(self.emoji_directory):
-                    file_count += len([f for f in files if f.endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp'))])
-                
-                # 删除整个表情包目录
-                shutil.rmtree(self.emoji_directory)
-                logger.info(f"已清理本地表情包目录: {self.emoji_directory}")
-                
-                return event.plain_result(f"✅ 已清理 {file_count} 个本地表情包文件\n\n📥 下次AI发送表情包时将重新按需下载")
-            else:
-                return event.plain_result("💭 本地表情包目录不存在，无需清理")
-                
+            spec = self.parse_cleanup_filter(filter_text)
+        except ValueError as e:
+            return event.plain_result(f"""❌ {e}
+
+🔧 使用方法: 清理本地表情包 [筛选条件...]
+   category=A,B     分类包含A或B
+   unused=N         N天未使用(支持h后缀表示小时，如 unused=12h)
+   size=N           文件大于N KB(支持m后缀表示MB，如 size=2m)
+   source=ID        指定数据源(数据源ID或地址)
+   keep=N           保留其中使用热度最高的N个
+   不填写条件时清理全部本地表情包
+
+示例: 清理本地表情包 unused=30 size=500""")
+        
+        try:
+            async with self.cleanup_lock:
+                removed_count, freed_bytes = await self.cleanup_local_emojis(spec)
         except Exception as e:
             logger.error(f"清理本地表情包失败: {e}")
             return event.plain_result(f"❌ 清理失败: {e}")
+        
+        if not removed_count:
+            return event.plain_result("💭 没有符合条件的本地表情包，无需清理")
+        return event.plain_result(f"✅ 已清理 {removed_count} 个本地表情包文件，释放 {self.format_bytes(freed_bytes)}\n\n📥 下次AI发送表情包时将重新按需下载")
+    
+    def parse_cleanup_filter(self, filter_text):
+        """解析清理筛选条件: category=分类1,分类2 unused=天数 size=KB source=数据源 keep=保留热度最高的N个"""
+        spec = {"categories": [], "unused_seconds": 0, "min_size": 0, "source": "", "keep": 0}
+        for token in filter_text.split():
+            key, _, value = token.partition("=")
+            key = key.lower()
+            value = value.strip().lower()
+            try:
+                if key in ("category", "分类") and value:
+                    spec["categories"] = [category.strip() for category in value.split(",") if category.strip()]
+                elif key in ("unused", "未使用") and value:
+                    unit = 3600 if value.endswith("h") else 86400
+                    spec["unused_seconds"] = float(value.rstrip("hd")) * unit
+                elif key in ("size", "大小") and value:
+                    unit = 1024 * 1024 if value.endswith("m") else 1024
+                    spec["min_size"] = int(float(value.rstrip("mk")) * unit)
+                elif key in ("source", "数据源") and value:
+                    spec["source"] = token.partition("=")[2].strip()
+                elif key in ("keep", "保留") and value.isdigit():
+                    spec["keep"] = int(value)
+                elif key != "all":
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"无法识别的筛选条件: {token}")
+        return spec
+    
+    async def cleanup_local_emojis(self, spec):
+        """在线程池中删除符合条件的本地表情包文件，返回 (删除数量, 释放字节数)
+        
+        分类、大小、数据源在目录快照上用掩码筛选；未使用时长优先取使用记录，没有记录时取文件修改时间
+        """
+        catalog = self.catalog
+        mask = catalog.available_mask.copy()
+        if spec["categories"]:
+            mask &= np.fromiter(
+                (any(keyword in category.lower() for keyword in spec["categories"]) for category in catalog.categories),
+                dtype=bool, count=len(catalog),
+            )
+        if spec["min_size"]:
+            mask &= catalog.file_sizes >= spec["min_size"]
+        if spec["source"]:
+            source_id = spec["source"] if spec["source"] in self.source_sections else self.get_source_id(spec["source"])
+            mask &= np.fromiter((emoji.get("source_id") == source_id for emoji in catalog.emoji_data),
+                                dtype=bool, count=len(catalog))
+        
+        # 同一个文件可能对应多个下标，按路径合并；只清理插件下载的文件，本地目录数据源中用户自己的文件不删除
+        store_prefix = os.path.join(self.emoji_directory, "")
+        targets = {}
+        for index in np.flatnonzero(mask):
+            emoji = catalog.emoji_data[index]
+            if emoji["local_path"].startswith(store_prefix):
+                targets.setdefault(emoji["local_path"], []).append(int(index))
+        if spec["keep"]:
+            # 保留热度最高的N个文件，热度相同时保留最近使用的
+            now = time.time()
+            ranked = sorted(targets, reverse=True, key=lambda path: (
+                self.usage_stats.emoji_score(catalog.emoji_ids[targets[path][0]], now),
+                self.last_used_at.get(catalog.emoji_ids[targets[path][0]], 0),
+            ))
+            for path in ranked[:spec["keep"]]:
+                del targets[path]
+        if not targets:
+            return 0, 0
+        
+        unused_before = time.time() - spec["unused_seconds"] if spec["unused_seconds"] else None
+        last_used = {path: self.last_used_at.get(catalog.emoji_ids[indices[0]]) for path, indices in targets.items()}
+        
+        loop = asyncio.get_running_loop()
+        removed = await loop.run_in_executor(None, self.remove_local_files, last_used, unused_before)
+        
+        # 删除期间目录快照可能已被重新加载替换，按路径更新当前快照
+        current = self.catalog
+        freed_bytes = 0
+        for path, size in removed:
+            freed_bytes += size
+            current.set_available(current.index_by_path.get(os.path.normpath(path), []), False)
+            self.append_store_journal(path, False)
+        logger.info(f"已清理 {len(removed)} 个本地表情包文件，释放 {self.format_bytes(freed_bytes)}")
+        return len(removed), freed_bytes
+    
+    def remove_local_files(self, last_used, unused_before=None):
+        """删除本地文件（在线程池中执行），返回 [(路径, 字节数)]，并清理删除后变空的分类目录"""
+        removed = []
+        parent_dirs = set()
+        for path, last_used_at in last_used.items():
+            try:
+                stat = os.stat(path)
+                if unused_before is not None and (last_used_at or stat.st_mtime) >= unused_before:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed.append((path, stat.st_size))
+            parent_dirs.add(os.path.dirname(path))
+        
+        for directory in sorted(parent_dirs, key=len, reverse=True):
+            # 只删除表情包工作目录下的空目录，保留工作目录本身
+            while directory.startswith(self.emoji_directory + os.sep):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                directory = os.path.dirname(directory)
+        return removed
+    
+    def parse_predownload_filter(self, filter_text):
+        """解析预下载筛选条件: anime(仅二次元) category=分类1,分类2 top=每种情感前N个 popular=按热度前N个 limit=最多数量"""
+        spec = {"anime_only": False, "categories": [], "top_per_emotion": 0, "popular": 0, "limit": 0}
+        for token in filter_text.split():
+            key, _, value = token.partition("=")
+            key = key.lower()
+            if key in ("anime", "二次元"):
+                spec["anime_only"] = True
+            elif key in ("category", "分类") and value:
+                spec["categories"] = [category.strip().lower() for category in value.split(",") if category.strip()]
+            elif key == "top" and value.isdigit():
+                spec["top_per_emotion"] = int(value)
+            elif key in ("popular", "热门") and value.isdigit():
+                spec["popular"] = int(value)
+            elif key == "limit" and value.isdigit():
+                spec["limit"] = int(value)
+            elif key != "all":
+                raise ValueError(f"无法识别的筛选条件: {token}")
+        return spec
+    
+    def select_predownload_targets(self, spec):
+        """按筛选条件选出需要预下载的表情包（排除已下载和失效地址）"""
+        catalog = self.catalog
+        emoji_count = len(catalog)
+        mask = ~self.get_negative_mask(catalog)
+        if spec["anime_only"]:
+            mask &= catalog.anime_mask
+        if spec["categories"]:
+            category_mask = np.fromiter(
+                (any(keyword in emoji.get("category", "").lower() for keyword in spec["categories"]) for emoji in catalog.emoji_data),
+                dtype=bool, count=emoji_count,
+            )
+            mask &= category_mask
+        if spec["top_per_emotion"]:
+            # 每种情感取得分最高的前N个（已下载的也计入名额）
+            top_mask = np.zeros(emoji_count, dtype=bool)
+            for label_scores in self.batch_emotion_scores(self.emotion_labels, mask, catalog):
+                ranked = np.argsort(-label_scores, kind="stable")[:spec["top_per_emotion"]]
+                top_mask[ranked[label_scores[ranked] > 0]] = True
+            mask &= top_mask
+        
+        target_indices = np.flatnonzero(mask & ~catalog.available_mask)
+        if spec["popular"]:
+            target_indices = self.rank_by_popularity(catalog, target_indices)[:spec["popular"]]
+        if spec["limit"]:
+            target_indices = target_indices[:spec["limit"]]
+        return [catalog.emoji_data[index] for index in target_indices]
+    
+    def rank_by_popularity(self, catalog, indices):
+        """按热度排序：先是用过的表情包（按衰减热度），再按与常用情感的匹配程度，两者都为0的不返回"""
+        now = time.time()
+        emoji_popularity = np.array([self.usage_stats.emoji_score(catalog.emoji_ids[i], now) for i in indices], dtype=np.float64)
+        emotion_popularity = np.array([self.usage_stats.emotion_score(label, now) for label in self.emotion_labels], dtype=np.float64)
+        relevance = catalog.emotion_scores[indices].astype(np.float64) @ emotion_popularity
+        order = np.lexsort((-relevance, -emoji_popularity))
+        order = order[(emoji_popularity[order] > 0) | (relevance[order] > 0)]
+        return indices[order]
+    
+    def get_predownload_state_file(self):
+        return os.path.join(self.emoji_directory, "predownload_state.json")
+    
+    def load_predownload_state(self):
+        try:
+            with open(self.get_predownload_state_file(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_predownload_state(self, status):
+        """保存预下载进度，status为running时下次启动会自动续传"""
+        try:
+            state = dict(self.predownload_progress, status=status)
+            with open(self.get_predownload_state_file(), 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            logger.warning(f"保存预下载进度失败: {e}")
+    
+    def start_predownload(self, filter_text, priority=PRIORITY_BULK):
+        """启动后台预下载任务，返回需要下载的数量
+        
+        priority 为下载优先级：启动时按配置预下载为预取，命令触发的为批量
+        """
+        spec = self.parse_predownload_filter(filter_text)
+        targets = self.select_predownload_targets(spec)
+        self.predownload_progress = {
+            "filter": filter_text,
+            "priority": priority,
+            "total": len(targets),
+            "done": 0,
+            "failed": 0,
+            "started_at": time.time(),
+        }
+        self.save_predownload_state("running")
+        self.predownload_task = asyncio.create_task(self.run_predownload(targets))
+        return len(targets)
+    
+    async def run_predownload(self, targets):
+        """有界并发地下载目标表情包，共享同一个会话，由下载调度为按需下载让行"""
+        queue = asyncio.Queue()
+        for emoji in targets:
+            queue.put_nowait(emoji)
+        progress = self.predownload_progress
+        report_step = max(1, len(targets) // 10)
+        logger.info(f"开始预下载 {len(targets)} 个表情包，并发数 {self.predownload_concurrency}")
+        
+        async def worker(session):
+            while not queue.empty():
+                emoji = queue.get_nowait()
+                
+                # 下载主机全部熔断时暂停等待冷却结束
+                while not self.is_download_available():
+                    await asyncio.sleep(5)
+                
+                if await self.download_single_emoji(emoji, session=session, priority=progress.get("priority", PRIORITY_BULK)):
+                    progress["done"] += 1
+                else:
+                    progress["failed"] += 1
+                
+                finished = progress["done"] + progress["failed"]
+                if finished % report_step == 0:
+                    logger.info(f"预下载进度: {finished}/{progress['total']} (成功{progress['done']}, 失败{progress['failed']})")
+                    self.save_predownload_state("running")
+                
+                await asyncio.sleep(self.predownload_interval)
+        
+        try:
+            async with self.create_download_session(self.predownload_concurrency) as session:
+                await asyncio.gather(*(worker(session) for _ in range(max(1, self.predownload_concurrency))))
+            self.save_predownload_state("done")
+            logger.info(f"预下载完成: 成功{progress['done']}个, 失败{progress['failed']}个, "
+                        f"耗时{time.time() - progress['started_at']:.0f}s")
+        except asyncio.CancelledError:
+            logger.info(f"预下载已中断: {progress['done'] + progress['failed']}/{progress['total']}")
+            raise
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("预下载表情包", "predownload_emojis")
+    async def predownload_command(self, event: AstrMessageEvent):
+        """按筛选条件在后台批量预下载表情包"""
+        if self.predownload_task and not self.predownload_task.done():
+            return event.plain_result("⚠️ 已有预下载任务在进行中，可使用「预下载状态」查看进度或「取消预下载」中止")
+        
+        filter_text = " ".join(event.get_message_str().split()[1:]) or self.predownload_filter
+        try:
+            total = self.start_predownload(filter_text)
+        except ValueError as e:
+            return event.plain_result(f"""❌ {e}
+
+🔧 使用方法: 预下载表情包 [筛选条件...]
+   anime            仅二次元表情包
+   category=A,B     分类包含A或B
+   top=N            每种情感得分最高的前N个
+   popular=N        按使用热度选前N个(用过的和常用情感的表情包)
+   limit=N          最多下载N个
+   all              不筛选
+
+示例: 预下载表情包 anime top=5""")
+        
+        return event.plain_result(f"📥 已开始后台预下载: {total} 个表情包\n筛选条件: {filter_text}\n并发数: {self.predownload_concurrency}，按需下载优先")
+    
+    async def run_profiled(self, name, coroutine):
+        """在性能分析采样中执行协程，达到采样上限后自动停止并写入报告"""
+        profiler = self.profiler
+        profiler.begin(name)
+        try:
+            return await coroutine
+        finally:
+            profiler.end()
+            if profiler is self.profiler and profiler.is_finished():
+                await self.stop_profiling()
+    
+    async def stop_profiling(self):
+        """停止性能分析并写入报告，返回 (pstats文件, 文本报告)"""
+        profiler, self.profiler = self.profiler, None
+        if self.profiler_timer:
+            self.profiler_timer.cancel()
+            self.profiler_timer = None
+        if profiler is None:
+            return None
+        
+        profile_directory = os.path.join(self.plugin_dir, "profiles")
+        os.makedirs(profile_directory, exist_ok=True)
+        output_prefix = os.path.join(profile_directory, time.strftime("profile_%Y%m%d_%H%M%S"))
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(None, profiler.finish, output_prefix)
+        logger.info(f"性能分析已结束，报告已写入: {files[1]}")
+        return files
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("开始性能分析", "start_profiling")
+    async def start_profiling_command(self, event: AstrMessageEvent):
+        """对接下来的回复处理和数据加载进行性能分析: events=事件数 或 seconds=秒数"""
+        if self.profiler is not None:
+            return event.plain_result("⚠️ 性能分析已在进行中，可使用「停止性能分析」提前结束")
+        
+        max_events, max_seconds = 0, 0
+        for token in event.get_message_str().split()[1:]:
+            key, _, value = token.partition("=")
+            if key in ("events", "事件") and value.isdigit():
+                max_events = int(value)
+            elif key in ("seconds", "秒") and value.isdigit():
+                max_seconds = int(value)
+            else:
+                return event.plain_result("❌ 使用方法: 开始性能分析 [events=N] [seconds=N]\n默认采样50个事件，最长600秒")
+        if not max_events and not max_seconds:
+            max_events, max_seconds = 50, 600
+        
+        try:
+            self.profiler = PipelineProfiler(max_events, max_seconds)
+        except ValueError as e:
+            # 已有其他性能分析工具在运行
+            return event.plain_result(f"❌ 无法开始性能分析: {e}")
+        if max_seconds:
+            self.profiler_timer = asyncio.get_running_loop().call_later(
+                max_seconds, lambda: asyncio.create_task(self.stop_profiling()))
+        
+        limits = "，".join(text for text in (f"{max_events}个事件" if max_events else "", f"{max_seconds}秒" if max_seconds else "") if text)
+        return event.plain_result(f"🔬 已开始性能分析，达到{limits}后自动停止\n报告将写入插件目录下的 profiles/")
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("停止性能分析", "stop_profiling")
+    async def stop_profiling_command(self, event: AstrMessageEvent):
+        """提前结束性能分析并写入报告"""
+        if self.profiler is None:
+            return event.plain_result("💭 当前没有进行中的性能分析")
+        events = sum(self.profiler.events.values())
+        pstats_file, report_file = await self.stop_profiling()
+        return event.plain_result(f"✅ 性能分析已结束，共采样 {events} 个事件\n📄 {os.path.relpath(pstats_file, self.plugin_dir)}\n📄 {os.path.relpath(report_file, self.plugin_dir)}")
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("取消预下载", "cancel_predownload")
+    async def cancel_predownload_command(self, event: AstrMessageEvent):
+        """取消正在进行的预下载任务"""
+        if not self.predownload_task or self.predownload_task.done():
+            return event.plain_result("💭 当前没有进行中的预下载任务")
+        
+        self.predownload_task.cancel()
+        self.save_predownload_state("cancelled")
+        progress = self.predownload_progress
+        return event.plain_result(f"⏹️ 已取消预下载: 完成 {progress['done'] + progress['failed']}/{progress['total']}")
+    
+    @filter.command("预下载状态", "predownload_status")
+    async def predownload_status_command(self, event: AstrMessageEvent):
+        """查看预下载任务进度"""
+        progress = self.predownload_progress or self.load_predownload_state()
+        if not progress:
+            return event.plain_result("💭 暂无预下载任务")
+        
+        running = bool(self.predownload_task and not self.predownload_task.done())
+        finished = progress.get("done", 0) + progress.get("failed", 0)
+        elapsed = max(1e-6, time.time() - progress.get("started_at", time.time()))
+        return event.plain_result(f"""预下载状态: {'进行中' if running else progress.get('status', '已结束')}
+
+筛选条件: {progress.get('filter')}
+进度: {finished}/{progress.get('total', 0)}
+成功: {progress.get('done', 0)}
+失败: {progress.get('failed', 0)}
+速度: {finished / elapsed:.2f} 个/秒""")
     
     @filter.command("查看使用历史", "check_usage_history")
     async def check_usage_history(self, event: AstrMessageEvent):
-        """查看表情包使用历史"""
-        if not self.recent_used_emojis:
+        """查看表情包使用历史和使用热度"""
+        top_emojis = self.usage_stats.top(self.usage_stats.emojis, 5)
+        if not self.recent_used_emojis and not top_emojis:
             return event.plain_result("表情包使用历史为空")
         
         history_text = "最近使用的表情包:\n\n"
@@ -403,6 +2718,12 @@ class LetAISendEmojisPlugin(Star):
         
         history_text += f"\n当前记录 {len(self.recent_used_emojis)}/{self.max_recent_history} 个，避免短期重复使用"
         
+        if top_emojis:
+            history_text += "\n\n使用热度最高的表情包:\n"
+            history_text += "\n".join(f"- {emoji_id}: {score:.1f}" for emoji_id, score in top_emojis)
+            top_emotions = self.usage_stats.top(self.usage_stats.emotions, 5)
+            history_text += "\n常用情感: " + ", ".join(f"{emotion}({score:.1f})" for emotion, score in top_emotions)
+        
         return event.plain_result(history_text)
     
     @filter.command("清空使用历史", "clear_usage_history")
@@ -416,31 +2737,24 @@ class LetAISendEmojisPlugin(Star):
     @filter.command("表情包统计", "emoji_stats")
     async def emoji_stats(self, event: AstrMessageEvent):
         """查看表情包统计信息"""
-        if not self.emoji_data:
+        catalog = self.catalog
+        if not catalog.emoji_data:
             return event.plain_result("❌ 表情包数据为空")
         
-        total_count = len(self.emoji_data)
-        downloaded_count = 0
-        anime_count = 0
-        
-        anime_categories = self.get_anime_categories()
+        # 计数在加载、下载和清理时增量维护，这里不再遍历目录
+        total_count = len(catalog)
+        downloaded_count = catalog.available_count
+        anime_count = catalog.anime_count
         
-        for emoji in self.emoji_data:
-            local_path = emoji.get("local_path")
-            if local_path and os.path.exists(local_path):
-                downloaded_count += 1
-            
-            emoji_name = emoji.get("name", "").lower()
-            emoji_category = emoji.get("category", "").lower()
-            is_anime = any(anime_key.lower() in emoji_category or 
-                          anime_key.lower() in emoji_name for anime_key in anime_categories)
-            if is_anime:
-                anime_count += 1
+        category_lines = "\n".join(
+            f"- {category or '未分类'}: {catalog.available_category_counts[category]}/{count}"
+            for category, count in catalog.category_counts.most_common(5)
+        )
         
         stats_text = f"""表情包统计信息:
 
 总表情包数量: {total_count}
-已下载到本地: {downloaded_count}
+已下载到本地: {downloaded_count} ({self.format_bytes(catalog.bytes_on_disk)})
 二次元表情包: {anime_count}
 使用历史记录: {len(self.recent_used_emojis)}/{self.max_recent_history}
 
@@ -448,6 +2762,18 @@ class LetAISendEmojisPlugin(Star):
 二次元占比: {(anime_count/total_count*100):.1f}%
 可下载数量: {total_count - downloaded_count}
 
+主要分类(已下载/总数):
+{category_lines}
+
+发送限流: 会话拒绝{self.chat_rate_rejections}次, 全局拒绝{self.global_rate_rejections}次
+{self.format_readiness()}
+{self.format_integrity_stats()}
+{self.format_load_stats()}
+处理阶段: 预热未完成跳过{self.pipeline_skips['not_ready']}次, 降载跳过{self.pipeline_skips['load_shed']}次, 门控跳过{self.pipeline_skips['probability_gate']}次, 限流跳过{self.pipeline_skips['rate_limit']}次, 分析后不发送{self.pipeline_skips['decision']}次, 无合适表情包{self.pipeline_skips['no_emoji']}次, 已发送{self.pipeline_skips['sent']}次
+{self.format_payload_cache_stats()}
+
+{self.format_download_health()}
+
 策略说明:
 - 30% 概率强制下载新表情包
 - 本地不足5个时强制下载
@@ -455,6 +2781,75 @@ class LetAISendEmojisPlugin(Star):
         
         return event.plain_result(stats_text)
     
+    def format_integrity_stats(self):
+        """最近一次完整性检查结果"""
+        summary = self.integrity_summary
+        if not summary:
+            return "完整性检查: 进行中" if self.integrity_task and not self.integrity_task.done() else "完整性检查: 未进行"
+        return (f"完整性检查: 校验{summary.get('ok', 0) + summary.get('bad', 0)}个, 跳过{summary.get('cached', 0)}个, "
+                f"隔离{summary.get('bad', 0)}个, 缺失{summary.get('missing', 0)}个, 耗时{summary['seconds']:.2f}s")
+    
+    def format_load_stats(self):
+        """负载自适应状态"""
+        if not self.adaptive_send:
+            return "负载自适应: 未开启"
+        monitor = self.load_monitor
+        scale = monitor.scale(self.adaptive_reply_rate, self.adaptive_loop_lag)
+        return (f"负载自适应: 回复速率{monitor.reply_rate():.2f}/s(阈值{self.adaptive_reply_rate}), "
+                f"事件循环延迟{monitor.loop_lag * 1000:.0f}ms(阈值{self.adaptive_loop_lag * 1000:.0f}ms), 发送概率系数{scale:.2f}")
+    
+    def format_readiness(self):
+        """启动预热耗时"""
+        parts = []
+        if "cache" in self.readiness:
+            parts.append(f"缓存快照 {self.readiness['cache']:.2f}s")
+        if "full" in self.readiness:
+            parts.append(f"完整加载 {self.readiness['full']:.2f}s")
+        elif self.is_warming_up():
+            parts.append("完整加载进行中")
+        return f"启动预热: {', '.join(parts) or '无'}"
+    
+    def format_payload_cache_stats(self):
+        """图片数据缓存状态文本"""
+        cache = self.payload_cache
+        if cache is None:
+            return "图片数据缓存: 已关闭"
+        return (f"图片数据缓存: {len(cache.entries)}个, {self.format_bytes(cache.total_bytes)}/{self.format_bytes(cache.max_bytes)}, "
+                f"命中率{cache.hit_rate() * 100:.1f}% ({cache.hits}/{cache.hits + cache.misses})")
+    
+    def format_download_health(self):
+        """下载镜像和熔断器状态文本"""
+        lines = ["下载熔断状态:"]
+        if not self.circuit_breakers:
+            lines.append("- 暂无下载记录")
+        for host, breaker in self.circuit_breakers.items():
+            if breaker.is_open():
+                state_text = f"熔断中(剩余{breaker.cooldown_remaining():.0f}s)"
+            elif breaker.state == "closed":
+                state_text = "正常"
+            else:
+                state_text = "半开试探" + ("(试探中)" if breaker.probe_in_flight else "")
+            lines.append(f"- {host}: {state_text}, 连续失败{breaker.consecutive_failures}次, "
+                         f"累计失败{breaker.total_failures}次, 熔断拒绝{breaker.rejected_requests}次")
+        
+        scheduler = self.download_scheduler
+        lines.append(f"下载调度: 进行中{scheduler.active}/{scheduler.global_limit}, 单主机上限{scheduler.per_host_limit}")
+        for priority, name in PRIORITY_NAMES.items():
+            average, p95 = scheduler.queue_time_stats(priority)
+            lines.append(f"- {name}: 进行中{scheduler.active_by_priority[priority]}, 排队{scheduler.queued_count(priority)}, "
+                         f"完成{scheduler.completed[priority]}, 排队时间平均{average * 1000:.0f}ms/p95 {p95 * 1000:.0f}ms")
+        
+        negative_mask = self.get_negative_mask(self.catalog)
+        permanent_count = sum(1 for entry in self.negative_cache.values() if entry["status"] in PERMANENT_FAILURE_STATUSES)
+        lines.append(f"失效地址缓存: {len(self.negative_cache)}个(永久失效{permanent_count}个), 排除候选{int(negative_mask.sum())}个")
+        
+        if self.mirror_stats:
+            lines.append("镜像统计:")
+            for mirror, stats in self.mirror_stats.items():
+                latency_text = f"{stats.latency * 1000:.0f}ms" if stats.latency is not None else "未知"
+                lines.append(f"- {urlparse(mirror).netloc or mirror}: 首字节{latency_text}, 成功{stats.successes}/失败{stats.failures}")
+        return "\n".join(lines)
+    
     @filter.command("查看AI情感状态", "check_ai_mood")
     async def check_ai_mood(self, event: AstrMessageEvent):
         """查看AI当前的情感状态和对话上下文"""
@@ -470,7 +2865,7 @@ class LetAISendEmojisPlugin(Star):
             for i, ctx in enumerate(self.conversation_context[-3:], 1):  # 显示最近3条
                 time_str = time.strftime("%H:%M:%S", time.localtime(ctx["timestamp"]))
                 mood_text += f"""
-{i}. [{time_str}] 用户:{ctx['user_emotion']} → AI:{ctx['ai_emotion']}
+{i}. [{time_str}] 用户:{ctx['user_emotion'] or '未分析'} → AI:{ctx['ai_emotion'] or '未分析'}
    回复: {ctx['ai_reply_sample']}"""
         else:
             mood_text += "\n   暂无对话记录"
@@ -544,8 +2939,11 @@ class LetAISendEmojisPlugin(Star):
         except ValueError:
             return event.plain_result("❌ 请输入有效的数字")
     
-    async def download_single_emoji(self, emoji):
-        """立即下载单个表情包"""
+    async def download_single_emoji(self, emoji, session=None, priority=PRIORITY_INTERACTIVE):
+        """立即下载单个表情包
+        
+        session 为批量下载时共享的会话；priority 为下载优先级，在下载调度中排队获取并发名额
+        """
         local_path = emoji.get("local_path")
         url = emoji.get("url")
         
@@ -553,45 +2951,343 @@ class LetAISendEmojisPlugin(Star):
             return False
         
         if os.path.exists(local_path):
+            self.mark_emoji_available(emoji)
+            return True
+        
+        if self.is_negatively_cached(url):
+            logger.debug(f"地址近期下载失败，跳过: {emoji.get('name')}")
+            return False
+        
+        # 创建目录
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        
+        # 按优先级排队获取全局和单主机并发名额
+        host = urlparse(url).netloc
+        await self.download_scheduler.acquire(priority, host)
+        download_lock = None
+        try:
+            # 共享插件目录的其他进程正在下载同一文件时等待其完成，避免重复下载
+            download_lock = await self.acquire_download_lock(url)
+            if download_lock is None:
+                logger.info(f"等待其他进程下载超时: {emoji.get('name')}")
+                return False
+            if os.path.exists(local_path):
+                logger.info(f"其他进程已下载: {emoji.get('name')}")
+                self.mark_emoji_available(emoji)
+                return True
+            
+            if session is None:
+                async with self.create_download_session() as session:
+                    return await self.fetch_emoji_file(session, emoji)
+            return await self.fetch_emoji_file(session, emoji)
+        finally:
+            if download_lock is not None:
+                download_lock.release()
+                if os.path.exists(local_path):
+                    # 文件已下载，之后获得同一个锁的进程都会直接使用文件，锁文件可以删除，避免锁目录无限增长
+                    try:
+                        os.remove(download_lock.lock_file)
+                    except OSError:
+                        pass
+            self.download_scheduler.release(priority, host)
+    
+    async def acquire_download_lock(self, url):
+        """获取跨进程的下载锁（每个地址一个锁文件，不相关的下载互不等待），超时返回None"""
+        lock_directory = os.path.join(self.emoji_directory, ".locks")
+        os.makedirs(lock_directory, exist_ok=True)
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        lock = FileLock(os.path.join(lock_directory, f"{url_hash}.lock"))
+        
+        deadline = time.monotonic() + self.request_timeout
+        while True:
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except Timeout:
+                if time.monotonic() >= deadline:
+                    return None
+                await asyncio.sleep(0.2)
+    
+    def create_download_session(self, concurrency=1):
+        """创建表情包下载会话，对冲请求需要同时连接多个镜像"""
+        timeout = aiohttp.ClientTimeout(total=15)
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        
+        connector = aiohttp.TCPConnector(
+            ssl=False,
+            limit=max(1, concurrency * len(self.download_mirrors)),
+            ttl_dns_cache=300,
+            use_dns_cache=True,
+        )
+        return aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector)
+    
+    async def fetch_emoji_file(self, session, emoji):
+        """通过镜像下载表情包文件到本地"""
+        local_path = emoji.get("local_path")
+        url = emoji.get("url")
+        
+        try:
+            logger.info(f"下载表情包: {emoji.get('name')} <- {url}")
+            
+            response, first_chunk, mirror = await self.open_with_mirrors(session, url)
+            # 先写入临时文件，完成后原子替换，其他进程不会看到不完整的文件
+            temp_path = f"{local_path}.{os.getpid()}.part"
+            async with response:
+                try:
+                    header, written = await self.stream_image_to_file(response, first_chunk, temp_path)
+                    os.replace(temp_path, local_path)
+                except BaseException:
+                    # 传输中断、内容校验失败或任务被取消，删除不完整的文件
+                    self.mirror_stats[mirror].record_failure()
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+            
+            # 记录图片格式、尺寸和大小，随数据源分区一起缓存
+            image_format = sniff_image_format(header)
+            width, height = parse_image_size(header, image_format)
+            emoji.update({"format": image_format, "width": width, "height": height, "size": written})
+            self.schedule_cache_save()
+            
+            logger.info(f"下载成功: {emoji.get('name')} ({image_format}, {width}x{height}, {self.format_bytes(written)})")
+            self.mark_emoji_available(emoji)
+            self.append_store_journal(local_path, True, written)
+            if self.negative_cache.pop(url, None):
+                self.schedule_cache_save()
+            return True
+                        
+        except InvalidPayloadError as e:
+            logger.warning(f"下载内容无效: {emoji.get('name')} - {e}")
+            self.record_download_failure(url, e.status)
+            return False
+        except MirrorRequestError as e:
+            if e.circuit_open:
+                # 主机熔断不代表地址失效，不记入负缓存
+                logger.info(f"下载熔断中，跳过下载: {emoji.get('name')}")
+            elif e.status is not None:
+                logger.warning(f"HTTP错误 {e.status}: {emoji.get('name')}")
+                self.record_download_failure(url, e.status)
+            else:
+                logger.warning(f"下载失败: {emoji.get('name')} - {e}")
+                self.record_download_failure(url)
+            return False
+        except Exception as e:
+            logger.warning(f"下载失败: {emoji.get('name')} - {e}")
+            self.record_download_failure(url)
+            return False
+    
+    async def stream_image_to_file(self, response, first_chunk, temp_path):
+        """边下载边校验并写入文件，返回 (文件头, 写入字节数)
+        
+        写入前按魔数确认是图片；Content-Length或已接收数据超过大小限制时立即中止；
+        实际长度与Content-Length不一致时视为不完整
+        """
+        content_length = response.content_length
+        if content_length is not None and content_length > self.max_emoji_bytes:
+            raise InvalidPayloadError(f"文件过大: {self.format_bytes(content_length)}", status=413)
+        
+        # 首个数据块可能很短，凑够识别格式所需的字节再判断
+        header = first_chunk
+        while len(header) < 32:
+            chunk = await response.content.readany()
+            if not chunk:
+                break
+            header += chunk
+        if sniff_image_format(header) is None:
+            raise InvalidPayloadError(f"不是图片 (Content-Type: {response.headers.get('Content-Type', '未知')})", status=415)
+        
+        written = 0
+        with open(temp_path, 'wb') as f:
+            f.write(header)
+            written += len(header)
+            async for chunk in response.content.iter_chunked(8192):
+                written += len(chunk)
+                if written > self.max_emoji_bytes:
+                    raise InvalidPayloadError(f"文件过大: 超过{self.format_bytes(self.max_emoji_bytes)}", status=413)
+                if len(header) < IMAGE_HEADER_BYTES:
+                    header += chunk[:IMAGE_HEADER_BYTES - len(header)]
+                f.write(chunk)
+        
+        # 压缩传输时Content-Length是压缩后的长度，无法比较
+        if content_length is not None and "Content-Encoding" not in response.headers and written != content_length:
+            raise InvalidPayloadError(f"下载不完整: {written}/{content_length} 字节")
+        return header, written
+    
+    def get_mirror_urls(self, url):
+        """将GitHub原始地址展开为各镜像地址，返回 [(镜像, 地址)]，非GitHub地址原样返回"""
+        if not url.startswith(GITHUB_RAW_PREFIX):
+            return [(urlparse(url).netloc, url)]
+        
+        path = url[len(GITHUB_RAW_PREFIX):]
+        parts = path.split("/", 3)
+        if len(parts) < 4:
+            return [(urlparse(url).netloc, url)]
+        fields = {"url": url, "path": path, "owner": parts[0], "repo": parts[1], "branch": parts[2], "file": parts[3]}
+        
+        mirror_urls = []
+        for mirror in self.download_mirrors:
+            if "{" in mirror:
+                try:
+                    mirror_url = mirror.format(**fields)
+                except (KeyError, IndexError, ValueError) as e:
+                    logger.warning(f"镜像模板无效: {mirror} - {e}")
+                    continue
+            else:
+                # 没有占位符时视为地址前缀
+                mirror_url = mirror.rstrip("/") + "/" + path
+            mirror_urls.append((mirror, mirror_url))
+        return mirror_urls or [(urlparse(url).netloc, url)]
+    
+    def rank_mirror_urls(self, mirror_urls):
+        """按镜像的期望代价（延迟/成功率）排序，配置顺序作为并列时的次序"""
+        return sorted(mirror_urls, key=lambda item: self.mirror_stats.setdefault(item[0], MirrorStats()).score())
+    
+    def get_circuit_breaker(self, url):
+        """获取URL所在主机的熔断器"""
+        host = urlparse(url).netloc
+        if host not in self.circuit_breakers:
+            self.circuit_breakers[host] = CircuitBreaker(self.circuit_breaker_threshold, self.circuit_breaker_cooldown)
+        return self.circuit_breakers[host]
+    
+    def is_download_available(self):
+        """是否还有可用的下载主机；所有已知主机都在熔断冷却期时返回False"""
+        if not self.circuit_breakers:
             return True
+        return not all(breaker.is_open() for breaker in self.circuit_breakers.values())
+    
+    async def fetch_first_chunk(self, session, mirror, mirror_url, headers=None, ok_statuses=(200,)):
+        """向单个镜像发起请求并等待首字节，返回 (响应, 首个数据块)"""
+        stats = self.mirror_stats.setdefault(mirror, MirrorStats())
+        breaker = self.get_circuit_breaker(mirror_url)
+        if not breaker.allow_request():
+            # 挑选镜像之后其他请求已占用了半开试探名额
+            raise MirrorRequestError(f"镜像主机处于熔断状态: {mirror_url}", circuit_open=True)
+        probing = breaker.state == "half_open"
+        start_time = time.monotonic()
+        try:
+            response = await session.get(mirror_url, headers=headers)
+        except asyncio.CancelledError:
+            stats.record_latency(time.monotonic() - start_time)
+            if probing:
+                breaker.release_probe()
+            raise
+        except Exception:
+            stats.record_failure()
+            breaker.record_failure()
+            raise
+        
+        # 主机能正常响应（包括404等永久错误）就不计入熔断失败
+        if response.status in TRANSIENT_HTTP_STATUSES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        
+        try:
+            if response.status not in ok_statuses:
+                raise MirrorRequestError(f"HTTP {response.status} ({mirror_url})", status=response.status)
+            first_chunk = await response.content.readany() if response.status == 200 else b""
+        except asyncio.CancelledError:
+            stats.record_latency(time.monotonic() - start_time)
+            response.release()
+            raise
+        except Exception:
+            stats.record_failure()
+            response.release()
+            raise
         
-        # 创建目录
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        stats.record_success(time.monotonic() - start_time)
+        return response, first_chunk
+    
+    async def open_with_mirrors(self, session, url, headers=None, ok_statuses=(200,)):
+        """带重试的镜像请求：临时错误按有界指数退避加随机抖动重试，熔断或永久错误立即放弃"""
+        for attempt in range(self.download_max_retries + 1):
+            try:
+                return await self.open_with_mirrors_once(session, url, headers, ok_statuses)
+            except MirrorRequestError as e:
+                if not e.transient or attempt >= self.download_max_retries:
+                    raise
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                logger.info(f"请求临时失败，{delay:.2f}s后重试({attempt + 1}/{self.download_max_retries}): {e}")
+                await asyncio.sleep(delay)
+    
+    async def open_with_mirrors_once(self, session, url, headers=None, ok_statuses=(200,)):
+        """按镜像排名发起请求；首字节超过自适应延迟仍未到达时，向下一个镜像发起对冲请求
         
-        timeout = aiohttp.ClientTimeout(total=15)
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+        返回 (响应, 首个数据块, 镜像)，调用方负责释放响应；所有镜像都失败时抛出 MirrorRequestError
+        """
+        # 跳过处于熔断冷却期或正在半开试探的主机，实际发起请求时才占用试探名额
+        mirror_urls = [(mirror, mirror_url) for mirror, mirror_url in self.get_mirror_urls(url)
+                       if self.get_circuit_breaker(mirror_url).can_attempt()]
+        if not mirror_urls:
+            raise MirrorRequestError(f"所有镜像主机均处于熔断状态: {url}", circuit_open=True)
+        ranked = self.rank_mirror_urls(mirror_urls)
+        pending = {}
+        next_index = 0
+        last_error = None
         
-        connector = aiohttp.TCPConnector(
-            ssl=False,
-            limit=1,
-            ttl_dns_cache=300,
-            use_dns_cache=True,
-        )
+        def launch_next():
+            nonlocal next_index
+            mirror, mirror_url = ranked[next_index]
+            next_index += 1
+            task = asyncio.create_task(self.fetch_first_chunk(session, mirror, mirror_url, headers, ok_statuses))
+            pending[task] = mirror
+            return mirror
         
         try:
-            logger.info(f"下载表情包: {emoji.get('name')} <- {url}")
-            
-            async with aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector) as session:
-                async with session.get(url) as response:
-                    if response.status == 200:
-                        with open(local_path, 'wb') as f:
-                            async for chunk in response.content.iter_chunked(8192):
-                                f.write(chunk)
-                        logger.info(f"下载成功: {emoji.get('name')}")
-                        return True
-                    else:
-                        logger.warning(f"HTTP错误 {response.status}: {emoji.get('name')}")
-                        return False
-                        
-        except Exception as e:
-            logger.warning(f"下载失败: {emoji.get('name')} - {e}")
-            return False
+            current_mirror = launch_next()
+            while pending:
+                hedge_delay = None
+                if self.enable_hedged_requests and next_index < len(ranked):
+                    hedge_delay = min(max(self.mirror_stats[current_mirror].hedge_delay(), 0.05), self.request_timeout)
+                
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首字节迟迟未到，对冲请求下一个镜像
+                    current_mirror = launch_next()
+                    logger.debug(f"镜像响应过慢，对冲请求: {current_mirror}")
+                    continue
+                
+                for task in done:
+                    mirror = pending.pop(task)
+                    if task.exception() is None:
+                        response, first_chunk = task.result()
+                        return response, first_chunk, mirror
+                    last_error = task.exception()
+                    logger.debug(f"镜像请求失败: {mirror} - {last_error}")
+                
+                # 当前所有请求都失败了，立即尝试下一个镜像
+                if not pending and next_index < len(ranked):
+                    current_mirror = launch_next()
+        finally:
+            # 取消落后的对冲请求，并释放已经返回的响应
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(lambda t: t.result()[0].release() if not t.cancelled() and t.exception() is None else None)
+        
+        if isinstance(last_error, MirrorRequestError):
+            raise last_error
+        raise MirrorRequestError(f"所有镜像请求失败: {last_error}")
     
     
     
     @filter.on_decorating_result()
     async def on_ai_reply(self, event: AstrMessageEvent):
-        if not self.enable_context_parsing or not self.emoji_data:
+        if self.profiler is None:
+            return await self.process_ai_reply(event)
+        return await self.run_profiled("on_ai_reply", self.process_ai_reply(event))
+    
+    async def process_ai_reply(self, event: AstrMessageEvent):
+        """分阶段处理AI回复：廉价门控 → 情感分析 → 表情包选择"""
+        if not self.enable_context_parsing:
+            return
+        load_scale = 1.0
+        if self.adaptive_send:
+            self.load_monitor.record_reply()
+            load_scale = self.load_monitor.scale(self.adaptive_reply_rate, self.adaptive_loop_lag)
+        if not self.emoji_data:
+            # 启动预热尚未得到可用的目录快照时直接跳过
+            if self.is_warming_up():
+                self.pipeline_skips["not_ready"] += 1
             return
             
         result = event.get_result()
@@ -608,6 +3304,23 @@ class LetAISendEmojisPlugin(Star):
             
         # 分析用户和AI的情感，并更新上下文
         # 获取用户消息
+        session_id = event.unified_msg_origin
+        
+        # 第一阶段：廉价门控。先抽取随机数，与不依赖情感分析的概率上限比较，
+        # 一定不会发送时跳过情感分析，只做轻量的上下文更新
+        # 负载过高时概率上限按比例缩小，被缩小部分拦下的回复计为降载跳过
+        draw = random.random()
+        max_probability = self.estimate_max_send_probability(ai_reply_text)
+        if draw >= max_probability * load_scale:
+            self.pipeline_skips["load_shed" if draw < max_probability else "probability_gate"] += 1
+            self.update_conversation_context_light(ai_reply_text)
+            return
+        if not self.acquire_send_token(session_id, consume=False):
+            self.pipeline_skips["rate_limit"] += 1
+            self.update_conversation_context_light(ai_reply_text)
+            return
+        
+        # 第二阶段：分析用户和AI的情感，并更新上下文
         user_message = event.get_message_str() if hasattr(event, 'get_message_str') else (event.message_str if hasattr(event, 'message_str') else "")
         
         user_emotion = self.analyze_user_emotion(user_message)
@@ -616,17 +3329,65 @@ class LetAISendEmojisPlugin(Star):
         # 更新对话上下文和AI情绪状态
         self.update_conversation_context(user_emotion, ai_emotion, ai_reply_text)
         
-        # 智能决定是否发送表情包（基于情感强度和上下文）
-        should_send_emoji = self.should_send_emoji_intelligent(user_emotion, ai_emotion, ai_reply_text)
+        # 智能决定是否发送表情包（基于情感强度和上下文），使用同一个随机数，发送概率与不分阶段时一致
+        should_send_emoji = self.should_send_emoji_intelligent(user_emotion, ai_emotion, ai_reply_text, draw, load_scale)
+        if not should_send_emoji:
+            self.pipeline_skips["decision"] += 1
+            return
         
-        if should_send_emoji:
-            selected_emoji = await self.search_emoji_by_emotion(ai_emotion, ai_reply_text)
-            
-            if selected_emoji:
-                logger.info(f"将单独发送表情包: {selected_emoji.get('name', '未知')}")
-                
-                # 异步发送表情包，不阻塞主消息
-                asyncio.create_task(self.send_emoji_separately(event, selected_emoji))
+        # 令牌桶限流：令牌不足时在搜索和下载之前直接跳过
+        if not self.acquire_send_token(session_id):
+            self.pipeline_skips["rate_limit"] += 1
+            return
+        
+        # 第三阶段：选择表情包
+        selected_emoji = await self.search_emoji_by_emotion(ai_emotion, ai_reply_text)
+        if not selected_emoji:
+            self.pipeline_skips["no_emoji"] += 1
+            return
+        
+        self.pipeline_skips["sent"] += 1
+        self.record_usage(selected_emoji, session_id, ai_emotion)
+        logger.info(f"将单独发送表情包: {selected_emoji.get('name', '未知')}")
+        
+        # 异步发送表情包，不阻塞主消息
+        asyncio.create_task(self.send_emoji_separately(event, selected_emoji))
+    
+    def acquire_send_token(self, session_id, consume=True):
+        """会话和全局令牌桶都有令牌时各消耗一个并返回True，否则记录拒绝并返回False
+        
+        consume=False 时只检查是否有令牌，不消耗也不记录拒绝（用于廉价门控）
+        """
+        if self.chat_rate_limit > 0:
+            chat_bucket = self.chat_buckets.get(session_id)
+            if chat_bucket is None:
+                if len(self.chat_buckets) >= 1000:
+                    # 已回满的令牌桶与新建的等价，可以丢弃
+                    self.chat_buckets = {key: bucket for key, bucket in self.chat_buckets.items() if not bucket.is_full()}
+                chat_bucket = self.chat_buckets[session_id] = TokenBucket(self.chat_rate_limit, self.chat_rate_burst)
+            if not chat_bucket.has_token():
+                if not consume:
+                    return False
+                chat_bucket.rejected += 1
+                self.chat_rate_rejections += 1
+                logger.debug(f"会话表情包发送过于频繁，跳过: {session_id}")
+                return False
+        
+        if self.global_rate_limit > 0:
+            if self.global_bucket is None:
+                self.global_bucket = TokenBucket(self.global_rate_limit, self.global_rate_burst)
+            if not self.global_bucket.has_token():
+                if not consume:
+                    return False
+                self.global_rate_rejections += 1
+                logger.debug("全局表情包发送过于频繁，跳过")
+                return False
+            if consume:
+                self.global_bucket.consume()
+        
+        if self.chat_rate_limit > 0 and consume:
+            chat_bucket.consume()
+        return True
     
     async def send_emoji_separately(self, event: AstrMessageEvent, selected_emoji):
         """单独发送表情包"""
@@ -637,17 +3398,38 @@ class LetAISendEmojisPlugin(Star):
             if local_path and os.path.exists(local_path):
                 logger.info(f"发送二次元表情包: {selected_emoji.get('name')}")
                 # 使用正确的消息链API发送图片
-                message_chain = MessageChain([Image(file=local_path)])
+                message_chain = MessageChain([await self.build_emoji_image(selected_emoji)])
                 await event.send(message_chain)
                 logger.info(f"表情包发送成功: {selected_emoji.get('name')}")
             else:
                 # 如果搜索方法返回了表情包但本地文件不存在，说明有问题
                 logger.error(f"表情包本地文件不存在: {selected_emoji.get('name')} - {local_path}")
                 logger.warning("跳过表情包发送")
+                # 文件已被外部删除，同步本地可用状态和统计计数
+                self.mark_emoji_available(selected_emoji, False)
                     
         except Exception as e:
             logger.error(f"发送表情包失败: {selected_emoji.get('name')} - {e}")
     
+    async def build_emoji_image(self, emoji):
+        """构建图片消息组件：启用缓存时使用缓存的base64数据，避免每次发送都重新读取和编码文件"""
+        local_path = emoji.get("local_path")
+        if self.payload_cache is None:
+            return Image(file=local_path)
+        
+        key = (self.get_emoji_id(emoji), os.stat(local_path).st_mtime_ns)
+        payload = self.payload_cache.get(key)
+        if payload is None:
+            loop = asyncio.get_running_loop()
+            payload = await loop.run_in_executor(None, self.encode_image_file, local_path)
+            self.payload_cache.put(key, payload)
+        return Image.fromBase64(payload)
+    
+    @staticmethod
+    def encode_image_file(local_path):
+        with open(local_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode('ascii')
+    
     def analyze_ai_reply_emotion(self, ai_reply: str):
         """深度分析AI回复的情感和内容，返回精准的情感标签"""
         reply_lower = ai_reply.lower()
@@ -773,256 +3555,183 @@ class LetAISendEmojisPlugin(Star):
     
     async def search_emoji_by_emotion(self, ai_emotion: str, ai_reply_text: str):
         """基于AI回复内容的主题精准搜索匹配的表情包（优先二次元，优先本地）"""
-        if not self.emoji_data:
+        # 整个选择过程使用同一份目录快照，不受期间热重载的影响
+        catalog = self.catalog
+        if not catalog.emoji_data:
             return None
             
-        anime_categories = self.get_anime_categories()
-        
-        # 基于AI回复内容主题的关键词映射
-        emotion_mapping = {
-            "happy_excited": {
-                "primary": ["开心", "笑", "高兴", "快乐", "哈哈", "嘻嘻", "兴奋", "激动", "开森", "快乐", "爽", "太棒"],
-                "secondary": ["好", "棒", "赞", "厉害", "牛", "爱了", "666"]
-            },
-            "friendly_warm": {
-                "primary": ["友好", "亲切", "微笑", "温暖", "欢迎", "你好", "见面", "打招呼"],
-                "secondary": ["好", "棒", "开心", "爱", "亲"]
-            },
-            "cute_playful": {
-                "primary": ["可爱", "萌", "卖萌", "软萌", "调皮", "淘气", "搞怪", "玩耍", "嬉戏", "呆萌", "小可爱"],
-                "secondary": ["逗", "乖", "小", "呆", "萌萌哒"]
-            },
-            "caring_gentle": {
-                "primary": ["关心", "照顾", "温柔", "体贴", "爱护", "安慰", "抱抱", "保重", "小心"],
-                "secondary": ["好", "乖", "温暖", "爱", "心疼"]
-            },
-            "thinking_wise": {
-                "primary": ["思考", "想", "考虑", "琢磨", "智慧", "学习", "明白", "理解", "分析", "研究"],
-                "secondary": ["疑问", "想想", "嗯", "思索"]
-            },
-            "surprised_curious": {
-                "primary": ["惊讶", "哇", "震惊", "意外", "好奇", "有趣", "探索", "发现", "没想到", "真的"],
-                "secondary": ["什么", "真的", "原来", "咦"]
-            },
-            "encouraging": {
-                "primary": ["加油", "努力", "支持", "相信", "坚持", "能行", "鼓励", "加把劲"],
-                "secondary": ["好", "棒", "厉害", "可以", "行"]
-            },
-            "food_related": {
-                "primary": ["吃", "美食", "饿", "香", "馋", "好吃", "味道", "料理", "饭", "菜", "食物", "餐厅", "烹饪"],
-                "secondary": ["口水", "流口水", "想吃", "香香", "饕餮"]
-            },
-            "sleep_tired": {
-                "primary": ["睡", "困", "累", "休息", "梦", "床", "被子", "打哈欠", "疲惫", "瞌睡"],
-                "secondary": ["想睡", "累了", "乏"]
-            },
-            "work_study": {
-                "primary": ["工作", "学习", "任务", "完成", "专注", "效率", "上班", "考试", "作业", "忙碌"],
-                "secondary": ["忙", "努力", "加班", "书", "学"]
-            },
-            "gaming": {
-                "primary": ["游戏", "玩", "通关", "技能", "战斗", "冒险", "娱乐", "开黑", "上分", "电竞", "操作"],
-                "secondary": ["打游戏", "玩游戏", "胜利", "输了", "菜"]
-            },
-            "apologetic": {
-                "primary": ["对不起", "抱歉", "不好意思", "sorry", "道歉", "错了"],
-                "secondary": ["错", "不对", "麻烦", "失误"]
-            },
-            "confused": {
-                "primary": ["疑惑", "困惑", "不明白", "想想", "不知道", "搞不懂", "迷茫"],
-                "secondary": ["什么", "为什么", "怎么", "咋办"]
-            },
-            "grateful": {
-                "primary": ["感谢", "谢谢", "感激", "感恩", "thanks", "多谢"],
-                "secondary": ["好", "棒", "爱了", "感动"]
-            }
-        }
+        # 未识别的情感使用默认映射
+        if ai_emotion not in self.emotion_labels:
+            ai_emotion = "neutral"
         
-        # 获取AI回复内容对应的关键词
-        mapping = emotion_mapping.get(ai_emotion, {
-            "primary": ["友好", "开心", "好"],
-            "secondary": ["棒", "不错"]
-        })
+        # 向量检索模式：按AI回复与表情包的相似度选择，无结果时回退到关键词匹配
+        if self.selection_mode == "vector" and catalog.vector_index is not None:
+            vector_match = await self.search_emoji_by_vector(ai_reply_text, catalog)
+            if vector_match:
+                return vector_match
+            logger.info("向量检索无合适结果，回退到关键词匹配")
         
-        primary_keywords = mapping["primary"]
-        secondary_keywords = mapping["secondary"]
+        # 下载主机全部熔断时不再等待网络超时，直接使用本地表情包
+        download_available = self.is_download_available()
         
         # 增加多样性策略：有40%概率跳过本地搜索，直接在线下载新表情包（提高获取更多动漫表情包的机会）
-        force_download = random.random() < 0.4
+        force_download = download_available and random.random() < 0.4
         
         if not force_download:
             # 第一步：在已下载的本地文件中搜索（优先二次元）
-            local_matches = await self.search_local_emojis(primary_keywords, secondary_keywords, anime_categories)
+            local_matches = await self.search_local_emojis(ai_emotion, catalog)
             if local_matches:
                 logger.info("使用本地表情包")
                 return local_matches
         else:
             logger.info("强制多样性模式：跳过本地搜索，直接下载新表情包")
+        
+        if not download_available:
+            logger.info("下载熔断中，仅使用本地表情包")
+            return self.select_local_only(ai_emotion, catalog)
             
         # 第二步：在完整数据源中搜索二次元表情包，找到后立即下载
-        return await self.search_and_download_anime_emoji(primary_keywords, secondary_keywords, anime_categories, ai_emotion)
+        return await self.search_and_download_anime_emoji(ai_emotion, catalog)
     
-    async def search_local_emojis(self, primary_keywords, secondary_keywords, anime_categories):
-        """在本地已下载的表情包中搜索（优先二次元）"""
-        local_perfect = []  # 本地二次元+主要关键词
-        local_good = []     # 本地二次元+次要关键词
-        local_anime = []    # 本地二次元表情包
-        local_other = []    # 本地其他匹配
-        
-        for emoji in self.emoji_data:
-            local_path = emoji.get("local_path")
-            if not local_path or not os.path.exists(local_path):
-                continue  # 只检查本地已存在的文件
-                
-            emoji_name = emoji.get("name", "").lower()
-            emoji_category = emoji.get("category", "").lower()
-            
-            # 检查是否为二次元表情包（更智能的匹配算法）
-            is_anime = self.is_anime_emoji(emoji_name, emoji_category, anime_categories)
-            
-            # 检查关键词匹配（更智能的匹配逻辑）
-            search_text = f"{emoji_name} {emoji_category}".lower()
-            
-            # 主要关键词匹配
-            primary_match = any(keyword in search_text for keyword in primary_keywords)
-            
-            # 次要关键词匹配
-            secondary_match = any(keyword in search_text for keyword in secondary_keywords)
+    def select_local_only(self, ai_emotion, catalog):
+        """无法下载时的本地兜底选择，不要求本地候选数量"""
+        selected_index, tier = self.select_from_pools(ai_emotion, catalog, local=True)
+        if selected_index is None:
+            candidate_mask = catalog.available_mask & ~self.get_recent_used_mask(catalog)
+            if not candidate_mask.any():
+                candidate_mask = catalog.available_mask
+            if not candidate_mask.any():
+                logger.info("本地没有可用的表情包")
+                return None
+            selected_index, tier = int(random.choice(np.flatnonzero(candidate_mask))), TIER_NONE
+        
+        selected = catalog.emoji_data[selected_index]
+        self.add_to_recent_used(selected)
+        logger.info(f"{TIER_LOCAL_DESCRIPTIONS.get(tier, '本地随机表情包')}(仅本地) - {selected.get('name')}")
+        return selected
+    
+    async def search_emoji_by_vector(self, ai_reply_text: str, catalog):
+        """基于TF-IDF向量相似度检索表情包（过滤最近使用，优先本地可用）"""
+        hits = catalog.vector_index.query(ai_reply_text, top_k=self.vector_top_k)
+        if not hits:
+            return None
+        
+        emoji_scores = {id(catalog.emoji_data[index]): score for index, score in hits}
+        hit_indices = [index for index, _ in hits]
+        recent_mask = self.get_recent_used_mask(catalog)
+        candidate_indices = [index for index in hit_indices if not recent_mask[index]]
+        if not candidate_indices:
+            # 所有候选都最近使用过，与filter_recently_used保持一致：重置使用历史
+            self.recent_used_emojis.clear()
+            candidate_indices = hit_indices
+        
+        negative_mask = self.get_negative_mask(catalog)
+        local_candidates = [catalog.emoji_data[index] for index in candidate_indices if catalog.available_mask[index]]
+        remote_candidates = [catalog.emoji_data[index] for index in candidate_indices
+                             if not catalog.available_mask[index] and not negative_mask[index]]
+        
+        # 按相似度加权随机选择，避免总是选中同一个表情包
+        if local_candidates:
+            weights = [emoji_scores[id(emoji)] for emoji in local_candidates]
+            selected = random.choices(local_candidates, weights=weights, k=1)[0]
+            self.add_to_recent_used(selected)
+            logger.info(f"向量检索命中本地表情包: {selected.get('name')} (相似度: {emoji_scores[id(selected)]:.3f})")
+            return selected
+        
+        if remote_candidates and self.is_download_available():
+            weights = [emoji_scores[id(emoji)] for emoji in remote_candidates]
+            selected = random.choices(remote_candidates, weights=weights, k=1)[0]
+            logger.info(f"向量检索选中表情包: {selected.get('name')} (相似度: {emoji_scores[id(selected)]:.3f})，开始下载")
+            if await self.download_single_emoji(selected):
+                self.add_to_recent_used(selected)
+                return selected
+            logger.warning(f"向量检索结果下载失败: {selected.get('name')}")
+        
+        return None
+    
+    def is_index_negative(self, catalog, index):
+        url = catalog.emoji_data[index].get("url")
+        return bool(url) and self.is_negatively_cached(url)
+    
+    def select_from_pools(self, ai_emotion, catalog, local, tiers=POOL_TIERS):
+        """从预计算的候选池中选择：取最高的非空匹配层级，过滤最近使用后按文件大小加权抽样
+        
+        远程候选额外排除负缓存中的失效地址。返回 (表情包下标, 匹配层级)，无候选时返回 (None, 0)
+        """
+        emotion_index = self.emotion_labels.index(ai_emotion)
+        recent_ids = set(self.recent_used_emojis)
+        for tier in tiers:
+            pool = catalog.get_pool(emotion_index, tier, local)
+            if not pool:
+                continue
             
-            # 从文件名中提取情感线索（文件名通常包含描述信息）
-            name_emotions = self.extract_emotion_from_filename(emoji_name)
-            emotion_enhanced_match = any(emotion in primary_keywords + secondary_keywords 
-                                       for emotion in name_emotions)
+            # 拒绝采样：跳过最近使用和失效的候选，按大小和热度权重接受（未下载的大小未知，不降权）
+            for _ in range(POOL_DRAW_ATTEMPTS):
+                index = pool.sample()
+                if catalog.emoji_ids[index] in recent_ids or (not local and self.is_index_negative(catalog, index)):
+                    continue
+                if random.random() < self.selection_weight(catalog, index):
+                    return index, tier
             
-            # 分类存储（优先二次元，二次元表情包有多重优先级）
-            if is_anime and (primary_match or emotion_enhanced_match):
-                # 二次元+完美匹配，添加多次增加权重
-                local_perfect.extend([emoji] * 3)  # 增加3倍权重
-            elif is_anime and secondary_match:
-                # 二次元+良好匹配，添加2次增加权重
-                local_good.extend([emoji] * 2)
-            elif is_anime:
-                # 纯二次元表情包，添加1.5倍权重
-                local_anime.extend([emoji] * 2)
-            elif primary_match or secondary_match or emotion_enhanced_match:
-                local_other.append(emoji)
-        
-        # 按优先级返回本地表情包，并过滤最近使用过的
-        all_local_candidates = local_perfect + local_good + local_anime + local_other
+            # 多次未命中时扫描整个池，结果分布与完整过滤一致
+            candidates = pool.items if local else [i for i in pool.items if not self.is_index_negative(catalog, i)]
+            if not candidates:
+                continue
+            filtered = [i for i in candidates if catalog.emoji_ids[i] not in recent_ids]
+            if not filtered:
+                # 所有候选都最近使用过，与filter_recently_used保持一致：重置使用历史
+                logger.info("所有候选表情包都最近使用过，重置使用历史")
+                self.recent_used_emojis.clear()
+                filtered = candidates
+            weights = [self.selection_weight(catalog, i) for i in filtered]
+            return random.choices(filtered, weights=weights, k=1)[0], tier
+        return None, TIER_NONE
+    
+    def selection_weight(self, catalog, index):
+        """同一层级内的选择权重(0~1]：较小的文件和较常用的表情包权重更高"""
+        weight = emoji_size_weight(catalog.file_sizes[index])
+        if self.popularity_weight > 0:
+            score = self.usage_stats.emoji_score(catalog.emoji_ids[index])
+            weight *= 1 - self.popularity_weight + self.popularity_weight * score / (score + 1)
+        return weight
+    
+    async def search_local_emojis(self, ai_emotion, catalog):
+        """在本地已下载的表情包中搜索（优先二次元）"""
+        # 按旧版候选列表的加权数量统计（完美匹配3倍、良好匹配和二次元2倍）
+        weighted_candidate_count = catalog.local_candidate_weight(self.emotion_labels.index(ai_emotion))
         
         # 如果本地可选表情包太少（少于8个），返回None强制在线下载（提高阈值，增加在线下载频率）
-        if len(all_local_candidates) < 8:
-            logger.info(f"本地表情包数量不足({len(all_local_candidates)}<8)，强制在线下载新表情包")
+        if weighted_candidate_count < 8:
+            logger.info(f"本地表情包数量不足({weighted_candidate_count}<8)，强制在线下载新表情包")
             return None
         
-        selected = None
-        selection_type = ""
-        
-        if local_perfect:
-            # 过滤最近使用的表情包
-            filtered_perfect = self.filter_recently_used(local_perfect)
-            if filtered_perfect:  # 确保过滤后还有可选项
-                selected = random.choice(filtered_perfect)
-                selection_type = "本地完美匹配: 二次元+主题关键词"
-        
-        if not selected and local_good:
-            filtered_good = self.filter_recently_used(local_good)
-            if filtered_good:
-                selected = random.choice(filtered_good)
-                selection_type = "本地良好匹配: 二次元+相关关键词"
-        
-        if not selected and local_anime:
-            filtered_anime = self.filter_recently_used(local_anime)
-            if filtered_anime:
-                selected = random.choice(filtered_anime)
-                selection_type = "本地二次元表情包"
-        
-        if not selected and local_other:
-            filtered_other = self.filter_recently_used(local_other)
-            if filtered_other:
-                selected = random.choice(filtered_other)
-                selection_type = "本地其他匹配"
-            
-        if selected:
-            # 添加到使用历史
-            self.add_to_recent_used(selected)
-            logger.info(f"{selection_type} - {selected.get('name')}")
-            return selected
-        else:
+        selected_index, tier = self.select_from_pools(ai_emotion, catalog, local=True)
+        if selected_index is None:
             # 本地表情包过滤后没有可选项，强制在线下载
             logger.info("本地表情包过滤后无可选项，强制在线下载新表情包")
             return None
+        
+        selected = catalog.emoji_data[selected_index]
+        self.add_to_recent_used(selected)
+        logger.info(f"{TIER_LOCAL_DESCRIPTIONS[tier]} - {selected.get('name')}")
+        return selected
     
-    async def search_and_download_anime_emoji(self, primary_keywords, secondary_keywords, anime_categories, ai_emotion):
+    async def search_and_download_anime_emoji(self, ai_emotion, catalog):
         """在完整数据源中搜索二次元表情包，找到后立即下载"""
-        anime_perfect = []  # 二次元+主要关键词
-        anime_good = []     # 二次元+次要关键词  
-        anime_all = []      # 所有二次元表情包
-        
-        logger.info(f"开始搜索二次元表情包，总数据量: {len(self.emoji_data)}")
-        
-        # 只搜索二次元表情包，且排除已下载的
-        checked_count = 0
-        anime_count = 0
-        for emoji in self.emoji_data:
-            emoji_name = emoji.get("name", "").lower()
-            emoji_category = emoji.get("category", "").lower()
-            
-            checked_count += 1
-            
-            # 检查是否为二次元表情包（更智能的匹配算法）
-            is_anime = self.is_anime_emoji(emoji_name, emoji_category, anime_categories)
-            
-            if is_anime:
-                anime_count += 1
-            
-            if not is_anime:
-                continue  # 只处理二次元表情包
-            
-            # 排除已经下载到本地的表情包，优先下载新的
-            local_path = emoji.get("local_path")
-            if local_path and os.path.exists(local_path):
-                continue  # 跳过已下载的，专注于下载新的
-            
-            # 检查关键词匹配
-            search_text = f"{emoji_name} {emoji_category}".lower()
-            primary_match = any(keyword in search_text for keyword in primary_keywords)
-            secondary_match = any(keyword in search_text for keyword in secondary_keywords)
-            
-            # 从文件名中提取情感线索
-            name_emotions = self.extract_emotion_from_filename(emoji_name)
-            emotion_enhanced_match = any(emotion in primary_keywords + secondary_keywords 
-                                       for emotion in name_emotions)
-            
-            # 分类存储（只保存二次元且未下载的）
-            if primary_match or emotion_enhanced_match:
-                anime_perfect.append(emoji)
-            elif secondary_match:
-                anime_good.append(emoji)
-            else:
-                anime_all.append(emoji)
-        
-        logger.info(f"表情包筛选结果: 总检查{checked_count}个, 识别为动漫{anime_count}个, 完美匹配{len(anime_perfect)}个, 良好匹配{len(anime_good)}个, 随机池{len(anime_all)}个")
-        
-        # 按优先级选择并下载表情包，过滤最近使用的
-        candidates = []
-        match_type = ""
-        
-        if anime_perfect:
-            candidates = self.filter_recently_used(anime_perfect)
-            match_type = f"完美匹配二次元+{ai_emotion}主题"
-        elif anime_good:
-            candidates = self.filter_recently_used(anime_good)
-            match_type = f"良好匹配二次元+相关主题"
-        elif anime_all:
-            # 从所有二次元表情包中选择一部分，然后过滤最近使用的
-            sample_size = min(50, len(anime_all))  # 进一步增加样本大小提高多样性
-            sampled = random.sample(anime_all, sample_size)
-            candidates = self.filter_recently_used(sampled)
-            match_type = "随机二次元表情包"
-        
-        if candidates:
-            selected = random.choice(candidates)
+        # 只搜索二次元表情包，且排除已下载的，专注于下载新的
+        emotion_index = self.emotion_labels.index(ai_emotion)
+        logger.info(f"表情包筛选结果: 总数{len(catalog.emoji_data)}个, 识别为动漫{catalog.anime_count}个, 未下载的"
+                    f"完美匹配{len(catalog.get_pool(emotion_index, TIER_PERFECT, False))}个, "
+                    f"良好匹配{len(catalog.get_pool(emotion_index, TIER_GOOD, False))}个, "
+                    f"随机池{len(catalog.get_pool(emotion_index, TIER_ANIME, False))}个")
+        
+        selected_index, tier = self.select_from_pools(ai_emotion, catalog, local=False, tiers=ANIME_POOL_TIERS)
+        if selected_index is not None:
+            selected = catalog.emoji_data[selected_index]
+            match_type = {
+                TIER_PERFECT: f"完美匹配二次元+{ai_emotion}主题",
+                TIER_GOOD: "良好匹配二次元+相关主题",
+            }.get(tier, "随机二次元表情包")
             logger.info(f"选中表情包: {match_type} - {selected.get('name')}")
             
             # 立即下载到本地并分类存储
@@ -1034,53 +3743,47 @@ class LetAISendEmojisPlugin(Star):
                 return selected
             else:
                 logger.warning(f"按需下载失败: {selected.get('name')}")
+                if not self.is_download_available():
+                    return self.select_local_only(ai_emotion, catalog)
                 return None
         else:
             # 如果严格的动漫搜索没有结果，使用宽松的随机选择作为后备
             logger.warning("严格的二次元表情包搜索无结果，启用后备模式")
-            return await self.fallback_emoji_selection()
+            return await self.fallback_emoji_selection(ai_emotion, catalog)
     
-    async def fallback_emoji_selection(self):
+    async def fallback_emoji_selection(self, ai_emotion, catalog):
         """后备表情包选择方法：从所有表情包中随机选择"""
-        if not self.emoji_data:
+        if not catalog.emoji_data:
             return None
+        
+        if not self.is_download_available():
+            logger.info("下载熔断中，后备模式仅使用本地表情包")
+            return self.select_local_only(ai_emotion, catalog)
             
-        # 获取所有未下载的表情包
-        available_emojis = []
-        for emoji in self.emoji_data:
-            local_path = emoji.get("local_path")
-            if not local_path or not os.path.exists(local_path):
-                available_emojis.append(emoji)
-        
-        if not available_emojis:
+        # 获取所有未下载且地址未失效的表情包
+        candidate_mask = ~catalog.available_mask & ~self.get_negative_mask(catalog)
+        if not candidate_mask.any():
             # 如果所有表情包都已下载，从所有表情包中选择
-            available_emojis = self.emoji_data.copy()
-        
-        # 从可用表情包中随机选择一个，过滤最近使用的
-        candidates = self.filter_recently_used(available_emojis)
-        if not candidates:
-            candidates = available_emojis  # 如果过滤后为空，使用全部
-        
-        # 随机选择
-        if candidates:
-            # 增加随机性：从候选中随机选择10-20个，再从中选择一个
-            sample_size = min(20, len(candidates))
-            sampled_candidates = random.sample(candidates, sample_size) if len(candidates) > sample_size else candidates
-            selected = random.choice(sampled_candidates)
-            
-            logger.info(f"后备模式选择表情包: {selected.get('name')} (来自{len(candidates)}个候选)")
-            
-            # 尝试下载
-            download_success = await self.download_single_emoji(selected)
-            if download_success:
-                self.add_to_recent_used(selected)
-                logger.info(f"后备模式下载成功: {selected.get('name')}")
-                return selected
-            else:
-                logger.warning(f"后备模式下载失败: {selected.get('name')}")
-                return None
+            candidate_mask = np.ones(len(catalog.emoji_data), dtype=bool)
         
-        return None
+        # 过滤最近使用的，如果过滤后为空，使用全部
+        filtered_mask = candidate_mask & ~self.get_recent_used_mask(catalog)
+        if filtered_mask.any():
+            candidate_mask = filtered_mask
+        candidate_indices = np.flatnonzero(candidate_mask)
+        
+        selected = catalog.emoji_data[int(random.choice(candidate_indices))]
+        logger.info(f"后备模式选择表情包: {selected.get('name')} (来自{len(candidate_indices)}个候选)")
+        
+        # 尝试下载
+        download_success = await self.download_single_emoji(selected)
+        if download_success:
+            self.add_to_recent_used(selected)
+            logger.info(f"后备模式下载成功: {selected.get('name')}")
+            return selected
+        else:
+            logger.warning(f"后备模式下载失败: {selected.get('name')}")
+            return None
     
     def extract_emotion_from_filename(self, filename):
         """从文件名中提取情感关键词"""
@@ -1210,6 +3913,7 @@ class LetAISendEmojisPlugin(Star):
             self.conversation_context.pop(0)
         
         # 更新AI情绪状态（考虑情绪一致性）
+        self.mood_updated_at = time.time()
         if random.random() < self.mood_consistency_factor:
             # 保持情绪连贯性
             self.current_ai_mood = self.blend_emotions(self.current_ai_mood, ai_emotion)
@@ -1219,6 +3923,27 @@ class LetAISendEmojisPlugin(Star):
         
         logger.debug(f"上下文更新: 用户情感={user_emotion}, AI情感={ai_emotion}, 当前AI情绪={self.current_ai_mood}")
     
+    def update_conversation_context_light(self, ai_reply_text):
+        """未进行情感分析时的轻量上下文更新：记录时间和回复长度，按关键词信号增量更新AI情绪"""
+        now = time.time()
+        match = MOOD_HINT_PATTERN.search(ai_reply_text)
+        if match:
+            # 与完整分析相同，按情绪一致性融合，不做随机突变
+            self.current_ai_mood = self.blend_emotions(self.current_ai_mood, MOOD_HINT_LOOKUP[match.group()])
+            self.mood_updated_at = now
+        elif self.current_ai_mood != "neutral" and now - self.mood_updated_at > MOOD_NEUTRAL_AFTER:
+            self.current_ai_mood = "neutral"
+        
+        self.conversation_context.append({
+            "timestamp": now,
+            "user_emotion": None,
+            "ai_emotion": None,
+            "ai_reply_length": len(ai_reply_text),
+            "ai_reply_sample": ai_reply_text[:50] + "..." if len(ai_reply_text) > 50 else ai_reply_text
+        })
+        if len(self.conversation_context) > self.max_context_length:
+            self.conversation_context.pop(0)
+    
     def blend_emotions(self, current_mood, new_emotion):
         """融合当前情绪和新情感，保持连贯性"""
         # 定义情感相容性矩阵
@@ -1255,8 +3980,23 @@ class LetAISendEmojisPlugin(Star):
         
         return transition_emotions.get(new_emotion, current_mood)
     
-    def should_send_emoji_intelligent(self, user_emotion, ai_emotion, ai_reply_text):
-        """智能判断是否应该发送表情包"""
+    def estimate_max_send_probability(self, ai_reply_text):
+        """不做情感分析时发送概率的上限：情感加成按最大值计算，只扣除与情感无关的减项"""
+        base_probability = self.send_probability + 0.2 + 0.15
+        
+        if len(ai_reply_text) < 30:
+            base_probability += 0.1
+        elif len(ai_reply_text) > 100:
+            base_probability -= 0.1
+        
+        # 当前回复加入上下文后，上一条记录就是should_send_emoji_intelligent中的倒数第二条
+        if self.conversation_context and time.time() - self.conversation_context[-1]["timestamp"] < 30:
+            base_probability -= 0.15
+        
+        return max(0.05, min(0.8, base_probability))
+    
+    def should_send_emoji_intelligent(self, user_emotion, ai_emotion, ai_reply_text, draw=None, load_scale=1.0):
+        """智能判断是否应该发送表情包，draw为预先抽取的随机数，load_scale为负载自适应的缩放系数"""
         base_probability = self.send_probability
         
         # 情感强度加成
@@ -1292,11 +4032,12 @@ class LetAISendEmojisPlugin(Star):
             if current_time - last_timestamp < 30:  # 30秒内
                 base_probability -= 0.15  # 降低频繁发送概率
         
-        # 确保概率在合理范围内
-        final_probability = max(0.05, min(0.8, base_probability))
+        # 确保概率在合理范围内，负载过高时再按比例缩小
+        final_probability = max(0.05, min(0.8, base_probability)) * load_scale
         
-        decision = random.random() < final_probability
-        logger.info(f"表情包发送决策: 基础概率={self.send_probability:.2f}, 调整后概率={final_probability:.2f}, 决定={'发送' if decision else '不发送'}")
+        decision = (random.random() if draw is None else draw) < final_probability
+        logger.info(f"表情包发送决策: 基础概率={self.send_probability:.2f}, 调整后概率={final_probability:.2f}"
+                    f"{f'(负载系数{load_scale:.2f})' if load_scale < 1 else ''}, 决定={'发送' if decision else '不发送'}")
         
         return decision
     
@@ -1336,9 +4077,15 @@ class LetAISendEmojisPlugin(Star):
         else:
             return "neutral"
     
+    def get_emoji_id(self, emoji):
+        """表情包唯一标识（多数据源时带数据源ID前缀）"""
+        emoji_id = emoji.get("name", "") + emoji.get("category", "")
+        source_id = emoji.get("source_id")
+        return f"{source_id}:{emoji_id}" if source_id else emoji_id
+    
     def add_to_recent_used(self, emoji):
         """添加表情包到最近使用记录"""
-        emoji_id = emoji.get("name", "") + emoji.get("category", "")
+        emoji_id = self.get_emoji_id(emoji)
         if emoji_id:
             # 如果已存在，先移除
             if emoji_id in self.recent_used_emojis:
@@ -1346,6 +4093,8 @@ class LetAISendEmojisPlugin(Star):
             
             # 添加到列表开头
             self.recent_used_emojis.insert(0, emoji_id)
+            self.last_used_at[emoji_id] = time.time()
+            self.usage_dirty = True
             
             # 保持历史记录长度限制
             if len(self.recent_used_emojis) > self.max_recent_history:
@@ -1355,7 +4104,7 @@ class LetAISendEmojisPlugin(Star):
     
     def is_recently_used(self, emoji):
         """检查表情包是否最近使用过"""
-        emoji_id = emoji.get("name", "") + emoji.get("category", "")
+        emoji_id = self.get_emoji_id(emoji)
         return emoji_id in self.recent_used_emojis
     
     def filter_recently_used(self, emoji_list):
@@ -1375,6 +4124,71 @@ class LetAISendEmojisPlugin(Star):
         logger.debug(f"过滤后表情包数量: {len(filtered)}/{len(emoji_list)}")
         return filtered
 
+    def get_emotion_keyword_mapping(self):
+        """获取AI回复情感对应的表情包关键词映射（neutral为未识别情感时的默认映射）"""
+        return {
+            "happy_excited": {
+                "primary": ["开心", "笑", "高兴", "快乐", "哈哈", "嘻嘻", "兴奋", "激动", "开森", "快乐", "爽", "太棒"],
+                "secondary": ["好", "棒", "赞", "厉害", "牛", "爱了", "666"]
+            },
+            "friendly_warm": {
+                "primary": ["友好", "亲切", "微笑", "温暖", "欢迎", "你好", "见面", "打招呼"],
+                "secondary": ["好", "棒", "开心", "爱", "亲"]
+            },
+            "cute_playful": {
+                "primary": ["可爱", "萌", "卖萌", "软萌", "调皮", "淘气", "搞怪", "玩耍", "嬉戏", "呆萌", "小可爱"],
+                "secondary": ["逗", "乖", "小", "呆", "萌萌哒"]
+            },
+            "caring_gentle": {
+                "primary": ["关心", "照顾", "温柔", "体贴", "爱护", "安慰", "抱抱", "保重", "小心"],
+                "secondary": ["好", "乖", "温暖", "爱", "心疼"]
+            },
+            "thinking_wise": {
+                "primary": ["思考", "想", "考虑", "琢磨", "智慧", "学习", "明白", "理解", "分析", "研究"],
+                "secondary": ["疑问", "想想", "嗯", "思索"]
+            },
+            "surprised_curious": {
+                "primary": ["惊讶", "哇", "震惊", "意外", "好奇", "有趣", "探索", "发现", "没想到", "真的"],
+                "secondary": ["什么", "真的", "原来", "咦"]
+            },
+            "encouraging": {
+                "primary": ["加油", "努力", "支持", "相信", "坚持", "能行", "鼓励", "加把劲"],
+                "secondary": ["好", "棒", "厉害", "可以", "行"]
+            },
+            "food_related": {
+                "primary": ["吃", "美食", "饿", "香", "馋", "好吃", "味道", "料理", "饭", "菜", "食物", "餐厅", "烹饪"],
+                "secondary": ["口水", "流口水", "想吃", "香香", "饕餮"]
+            },
+            "sleep_tired": {
+                "primary": ["睡", "困", "累", "休息", "梦", "床", "被子", "打哈欠", "疲惫", "瞌睡"],
+                "secondary": ["想睡", "累了", "乏"]
+            },
+            "work_study": {
+                "primary": ["工作", "学习", "任务", "完成", "专注", "效率", "上班", "考试", "作业", "忙碌"],
+                "secondary": ["忙", "努力", "加班", "书", "学"]
+            },
+            "gaming": {
+                "primary": ["游戏", "玩", "通关", "技能", "战斗", "冒险", "娱乐", "开黑", "上分", "电竞", "操作"],
+                "secondary": ["打游戏", "玩游戏", "胜利", "输了", "菜"]
+            },
+            "apologetic": {
+                "primary": ["对不起", "抱歉", "不好意思", "sorry", "道歉", "错了"],
+                "secondary": ["错", "不对", "麻烦", "失误"]
+            },
+            "confused": {
+                "primary": ["疑惑", "困惑", "不明白", "想想", "不知道", "搞不懂", "迷茫"],
+                "secondary": ["什么", "为什么", "怎么", "咋办"]
+            },
+            "grateful": {
+                "primary": ["感谢", "谢谢", "感激", "感恩", "thanks", "多谢"],
+                "secondary": ["好", "棒", "爱了", "感动"]
+            },
+            "neutral": {
+                "primary": ["友好", "开心", "好"],
+                "secondary": ["棒", "不错"]
+            }
+        }
+    
     def get_anime_categories(self):
         """获取二次元/动漫相关的分类关键词"""
         return [
@@ -0,0 +1,80 @@
+"""下载相关测试的公共fixture：本地模拟CDN和在临时目录中运行的插件实例
+
+需要在安装了AstrBot的环境中运行（插件依赖astrbot.api），不访问外网。
+环境中没有pytest-asyncio，测试通过 loop fixture 提供的事件循环执行协程。
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+import main as plugin_module  # noqa: E402
+from fake_cdn import FakeCDN  # noqa: E402
+
+
+class FakeContext:
+    """插件只在初始化时保存context，测试不需要真实的AstrBot上下文"""
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def start_cdn(loop):
+    """启动模拟CDN的工厂，测试结束时全部停止；错误率、截断率等属性可以在启动后修改"""
+    servers = []
+
+    def start(**options):
+        options.setdefault("image_count", 30)
+        options.setdefault("min_size", 1024)
+        options.setdefault("max_size", 8 * 1024)
+        cdn = loop.run_until_complete(FakeCDN(**options).start())
+        servers.append(cdn)
+        return cdn
+
+    yield start
+    for cdn in servers:
+        loop.run_until_complete(cdn.stop())
+
+
+@pytest.fixture
+def fake_cdn(start_cdn):
+    return start_cdn()
+
+
+@pytest.fixture
+def make_plugin(loop, fake_cdn, tmp_path):
+    """在临时目录中创建插件并完成预热，默认只使用 fake_cdn 一个镜像，测试结束时停止插件"""
+    plugins = []
+
+    def make(mirrors=None, **overrides):
+        config = {
+            "emoji_source": plugin_module.DEFAULT_EMOJI_SOURCE,
+            "download_mirrors": mirrors or [fake_cdn.mirror_template],
+            "source_watch_interval": 0,
+            "store_sync_interval": 0,
+            "predownload_interval": 0,
+            "integrity_scan_on_startup": False,
+        }
+        config.update(overrides)
+        plugin = plugin_module.LetAISendEmojisPlugin(FakeContext(), config)
+        plugin.plugin_dir = str(tmp_path)
+        plugin.emoji_directory = str(tmp_path / "emojis")
+        loop.run_until_complete(plugin.initialize())
+        loop.run_until_complete(plugin.warmup_task)
+        plugins.append(plugin)
+        return plugin
+
+    yield make
+    for plugin in plugins:
+        loop.run_until_complete(plugin.terminate())
@@ -0,0 +1,139 @@
+"""基于本地模拟CDN的下载测试：截断、大小限制、熔断、对冲请求和下载优先级"""
+
+import asyncio
+import os
+import time
+
+import main as plugin_module
+
+
+def list_files(directory):
+    return [name for _, _, names in os.walk(directory) for name in names]
+
+
+def test_truncated_body_is_not_left_on_disk(loop, fake_cdn, make_plugin):
+    plugin = make_plugin(download_max_retries=0)
+    fake_cdn.truncate_rate = 1.0
+    emoji = plugin.emoji_data[0]
+
+    assert loop.run_until_complete(plugin.download_single_emoji(emoji)) is False
+    assert fake_cdn.stats["truncated"] == 1
+    assert not os.path.exists(emoji["local_path"])
+    assert not any(name.endswith(".part") for name in list_files(plugin.emoji_directory))
+    assert plugin.catalog.available_count == 0
+
+
+def test_oversized_body_is_aborted_and_negatively_cached(loop, start_cdn, make_plugin):
+    cdn = start_cdn(min_size=64 * 1024, max_size=64 * 1024)
+    plugin = make_plugin(mirrors=[cdn.mirror_template], max_emoji_size_mb=0.03)
+    emoji = plugin.emoji_data[0]
+
+    assert loop.run_until_complete(plugin.download_single_emoji(emoji)) is False
+    assert not os.path.exists(emoji["local_path"])
+    assert plugin.negative_cache[emoji["url"]]["status"] == 413
+    assert plugin.is_negatively_cached(emoji["url"])
+
+    # 负缓存期间不再请求服务器
+    requests = cdn.stats["requests"]
+    assert loop.run_until_complete(plugin.download_single_emoji(emoji)) is False
+    assert cdn.stats["requests"] == requests
+
+
+def test_503_storm_opens_breaker_and_falls_back_to_local(loop, fake_cdn, make_plugin):
+    plugin = make_plugin(circuit_breaker_threshold=3, circuit_breaker_cooldown=60, download_max_retries=0)
+    local_emoji = plugin.emoji_data[0]
+    assert loop.run_until_complete(plugin.download_single_emoji(local_emoji)) is True
+
+    fake_cdn.error_rate = 1.0
+    for emoji in plugin.emoji_data[1:4]:
+        assert loop.run_until_complete(plugin.download_single_emoji(emoji)) is False
+    assert not plugin.is_download_available()
+
+    requests = fake_cdn.stats["requests"]
+    for _ in range(5):
+        selected = loop.run_until_complete(plugin.search_emoji_by_emotion("happy_excited", "哈哈好开心"))
+        assert selected is not None
+        assert os.path.exists(selected["local_path"])
+    assert fake_cdn.stats["requests"] == requests
+
+
+def test_hedged_request_wins_when_first_mirror_is_slow(loop, fake_cdn, start_cdn, make_plugin):
+    slow_cdn = start_cdn(latency=3.0)
+    plugin = make_plugin(mirrors=[slow_cdn.mirror_template, fake_cdn.mirror_template], request_timeout=15)
+    # 索引已经加载完成，之后的请求按镜像配置顺序先发往慢镜像
+    plugin.mirror_stats.clear()
+    emoji = plugin.emoji_data[0]
+
+    start = time.monotonic()
+    assert loop.run_until_complete(plugin.download_single_emoji(emoji)) is True
+    assert time.monotonic() - start < slow_cdn.latency
+    assert fake_cdn.stats["images"] == 1
+    assert os.path.exists(emoji["local_path"])
+
+
+def test_interactive_download_is_not_blocked_by_bulk(loop, fake_cdn, make_plugin):
+    fake_cdn.latency = 0.5
+    plugin = make_plugin(download_concurrency=6, download_per_host_limit=4, predownload_concurrency=6)
+
+    async def scenario():
+        plugin.start_predownload("limit=20")
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+        assert await plugin.download_single_emoji(plugin.emoji_data[-1]) is True
+        elapsed = time.monotonic() - start
+        bulk_running = not plugin.predownload_task.done()
+        await plugin.predownload_task
+        return elapsed, bulk_running
+
+    elapsed, bulk_running = loop.run_until_complete(scenario())
+    assert bulk_running
+    # 只需等待自身一次请求的延迟，不需要等后台任务让出名额
+    assert elapsed < fake_cdn.latency * 1.8
+
+
+def test_scheduler_reserves_interactive_slot_per_host(loop):
+    scheduler = plugin_module.DownloadScheduler(6, 4)
+
+    async def scenario():
+        bulk = [asyncio.ensure_future(scheduler.acquire(plugin_module.PRIORITY_BULK, "cdn")) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert scheduler.active_by_host["cdn"] == 3
+        await asyncio.wait_for(scheduler.acquire(plugin_module.PRIORITY_INTERACTIVE, "cdn"), 1)
+        assert scheduler.queued_count(plugin_module.PRIORITY_BULK) == 1
+        for task in bulk:
+            task.cancel()
+
+    loop.run_until_complete(scenario())
+
+
+def test_half_open_breaker_allows_a_single_probe():
+    breaker = plugin_module.CircuitBreaker(failure_threshold=1, cooldown=60)
+    breaker.record_failure()
+    assert not breaker.allow_request()
+
+    breaker.opened_at -= 60
+    assert breaker.can_attempt()
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.can_attempt()
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_only_the_tried_mirror_moves_to_half_open(loop, fake_cdn, start_cdn, make_plugin):
+    other_cdn = start_cdn()
+    plugin = make_plugin(mirrors=[fake_cdn.mirror_template, other_cdn.mirror_template], circuit_breaker_threshold=1)
+    plugin.mirror_stats.clear()
+    emoji = plugin.emoji_data[0]
+    breakers = [plugin.get_circuit_breaker(mirror_url) for _, mirror_url in plugin.get_mirror_urls(emoji["url"])]
+    for breaker in breakers:
+        breaker.record_failure()
+        breaker.opened_at -= plugin.circuit_breaker_cooldown
+
+    assert loop.run_until_complete(plugin.download_single_emoji(emoji)) is True
+    assert breakers[0].state == "closed"
+    assert breakers[1].state == "open"
+    assert other_cdn.stats["images"] == 0
@@ -0,0 +1,185 @@
+"""表情包下载压测：基于本地模拟CDN测量冷启动首个表情包耗时、批量下载吞吐量和并发回复下的选择延迟
+
+需要在安装了AstrBot的环境中运行（插件依赖astrbot.api），不访问外网:
+
+    python tools/bench_downloads.py --images 1000 --latency 0.05 --bandwidth 2000000 --error-rate 0.05
+
+所有数据写入临时目录，不影响插件目录下已有的表情包和缓存。
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from astrbot.api import logger  # noqa: E402
+import main as plugin_module  # noqa: E402
+from fake_cdn import FakeCDN  # noqa: E402
+
+REPLY_TEXTS = [
+    "哈哈今天真开心，一起去玩吧", "呜呜好难过啊", "这也太让人生气了", "诶？真的吗，好惊讶",
+    "好困，想睡觉了", "加油，你一定可以的", "谢谢你的帮助", "嗯……让我想想", "好饿，想吃好吃的",
+]
+
+
+class BenchContext:
+    """插件只在初始化时保存context，压测不需要真实的AstrBot上下文"""
+
+
+def make_plugin(cdn, workdir, **overrides):
+    config = {
+        "emoji_source": plugin_module.DEFAULT_EMOJI_SOURCE,
+        "download_mirrors": [cdn.mirror_template],
+        "source_watch_interval": 0,
+        "store_sync_interval": 0,
+        "predownload_interval": 0,
+    }
+    config.update(overrides)
+    plugin = plugin_module.LetAISendEmojisPlugin(BenchContext(), config)
+    plugin.plugin_dir = workdir
+    plugin.emoji_directory = os.path.join(workdir, "emojis")
+    return plugin
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def bench_cold_start(cdn, workdir):
+    """冷启动：加载索引，然后测量第一次回复得到表情包的耗时"""
+    plugin = make_plugin(cdn, workdir)
+    start = time.perf_counter()
+    await plugin.initialize()
+    init_seconds = time.perf_counter() - start
+    await plugin.warmup_task
+
+    start = time.perf_counter()
+    selected, attempts = None, 0
+    while selected is None and attempts < 20:
+        attempts += 1
+        selected = await plugin.search_emoji_by_emotion(random.choice(plugin.emotion_labels), random.choice(REPLY_TEXTS))
+    first_emoji_seconds = time.perf_counter() - start
+    await plugin.terminate()
+    print(f"冷启动: initialize返回 {init_seconds * 1000:.0f}ms, 加载完成 {plugin.readiness.get('full', 0) * 1000:.0f}ms "
+          f"(表情包 {len(plugin.catalog)} 个), "
+          f"首个表情包 {first_emoji_seconds * 1000:.0f}ms ({attempts} 次尝试, {'成功' if selected else '失败'})")
+
+
+async def bench_warm_start(cdn, workdir):
+    """热启动：同一目录再次启动，索引应命中ETag条件请求"""
+    not_modified = cdn.stats["index_not_modified"]
+    plugin = make_plugin(cdn, workdir)
+    start = time.perf_counter()
+    await plugin.initialize()
+    init_seconds = time.perf_counter() - start
+    await plugin.warmup_task
+    await plugin.terminate()
+    print(f"热启动: initialize返回 {init_seconds * 1000:.0f}ms, 缓存快照可用 {plugin.readiness.get('cache', 0) * 1000:.0f}ms, "
+          f"加载完成 {plugin.readiness.get('full', 0) * 1000:.0f}ms, 本地可用 {plugin.catalog.available_count} 个, "
+          f"索引304: {'是' if cdn.stats['index_not_modified'] > not_modified else '否'}")
+
+
+async def bench_throughput(cdn, workdir, count, concurrency):
+    """批量预下载吞吐量"""
+    plugin = make_plugin(cdn, workdir, predownload_concurrency=concurrency)
+    await plugin.initialize()
+    await plugin.warmup_task
+    bytes_before = plugin.catalog.bytes_on_disk
+    requests_before = cdn.stats["requests"]
+
+    start = time.perf_counter()
+    total = plugin.start_predownload(f"limit={count}")
+    await plugin.predownload_task
+    seconds = time.perf_counter() - start
+    progress = plugin.predownload_progress
+    downloaded_bytes = plugin.catalog.bytes_on_disk - bytes_before
+    await plugin.terminate()
+    print(f"批量下载(并发{concurrency}): {progress['done']}/{total} 成功, {progress['failed']} 失败, "
+          f"{progress['done'] / seconds:.1f} 个/s, {downloaded_bytes / seconds / 1024 / 1024:.2f} MB/s, "
+          f"服务器请求 {cdn.stats['requests'] - requests_before} 次")
+
+
+async def bench_concurrent_replies(cdn, workdir, replies, concurrency):
+    """并发回复：多个回复同时选择表情包（部分需要按需下载）时的延迟分布"""
+    plugin = make_plugin(cdn, workdir)
+    await plugin.initialize()
+    await plugin.warmup_task
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    hits = 0
+
+    async def reply():
+        nonlocal hits
+        async with semaphore:
+            start = time.perf_counter()
+            selected = await plugin.search_emoji_by_emotion(random.choice(plugin.emotion_labels), random.choice(REPLY_TEXTS))
+            latencies.append(time.perf_counter() - start)
+            hits += selected is not None
+
+    start = time.perf_counter()
+    await asyncio.gather(*(reply() for _ in range(replies)))
+    seconds = time.perf_counter() - start
+    await plugin.terminate()
+    print(f"并发回复({concurrency}并发): {replies} 次, 选中 {hits} 次, {replies / seconds:.1f} 次/s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.0f}ms, p95 {percentile(latencies, 0.95) * 1000:.0f}ms, "
+          f"最大 {max(latencies) * 1000:.0f}ms, 平均 {statistics.mean(latencies) * 1000:.0f}ms")
+
+
+async def run(args):
+    cdn = await FakeCDN(
+        image_count=args.images, latency=args.latency, bandwidth=args.bandwidth,
+        error_rate=args.error_rate, truncate_rate=args.truncate_rate, seed=args.seed,
+    ).start()
+    workdir = tempfile.mkdtemp(prefix="letai_bench_")
+    try:
+        print(f"模拟CDN: {cdn.base_url}, {args.images} 个表情包, 延迟 {args.latency}s, "
+              f"带宽 {args.bandwidth or '不限'}, 错误率 {args.error_rate}, 截断率 {args.truncate_rate}")
+        await bench_cold_start(cdn, workdir)
+        await bench_throughput(cdn, workdir, args.downloads, args.concurrency)
+        await bench_concurrent_replies(cdn, workdir, args.replies, args.reply_concurrency)
+        await bench_warm_start(cdn, workdir)
+        print(f"服务器统计: {dict(cdn.stats)}")
+    finally:
+        await cdn.stop()
+        if args.keep:
+            print(f"数据目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="表情包下载压测")
+    parser.add_argument("--images", type=int, default=500, help="模拟CDN上的表情包数量")
+    parser.add_argument("--latency", type=float, default=0.02, help="首字节延迟(秒)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="每连接带宽(字节/秒)，0为不限制")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的概率")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="截断响应的概率")
+    parser.add_argument("--downloads", type=int, default=200, help="批量下载的表情包数量")
+    parser.add_argument("--concurrency", type=int, default=4, help="批量下载并发数")
+    parser.add_argument("--replies", type=int, default=200, help="并发回复测试的回复数量")
+    parser.add_argument("--reply-concurrency", type=int, default=20, help="同时处理的回复数量")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="保留临时数据目录")
+    parser.add_argument("--verbose", action="store_true", help="输出插件日志")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
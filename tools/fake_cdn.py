@@ -0,0 +1,166 @@
+"""本地模拟CDN：提供合成的ChineseBQB索引和表情包图片，用于在不访问GitHub的情况下测试和压测下载逻辑
+
+可配置延迟、带宽、错误率、截断率，索引支持ETag条件请求。插件通过镜像模板指向本服务器:
+
+    cdn = FakeCDN(image_count=500, latency=0.05)
+    await cdn.start()
+    config = {"emoji_source": DEFAULT_EMOJI_SOURCE, "download_mirrors": [cdn.mirror_template]}
+
+测试中通过 tests/conftest.py 的 fake_cdn fixture 使用，启动后可以修改 error_rate、truncate_rate、latency 模拟故障。
+也可以单独运行，供手动调试使用: python tools/fake_cdn.py --images 500 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import struct
+import time
+from collections import Counter
+
+from aiohttp import web
+
+INDEX_PATH = "zhaoolee/ChineseBQB/master/chinesebqb_github.json"
+IMAGE_PREFIX = "zhaoolee/ChineseBQB/master/"
+
+CATEGORIES = ["001Funny_滑稽大法", "002Love_喜欢你", "013Anime_动漫", "016Cat_猫咪", "023Kumamon_熊本熊", "045Girl_可爱女孩纸"]
+NAMES = ["开心", "哈哈大笑", "可爱", "生气", "哭泣", "难过", "惊讶", "疑惑", "害羞", "睡觉", "吃饭", "加油", "谢谢", "拜拜", "无语"]
+
+
+def make_gif(width, height, size):
+    """生成指定大小的GIF数据：合法的文件头（可解析尺寸）+ 填充字节"""
+    header = b"GIF89a" + struct.pack("<HH", width, height) + b"\x00\x00\x00"
+    return header + b"\x00" * max(0, size - len(header) - 1) + b";"
+
+
+class FakeCDN:
+    """模拟CDN服务器，记录各类请求的计数"""
+
+    def __init__(self, image_count=200, latency=0.0, bandwidth=0, error_rate=0.0, truncate_rate=0.0,
+                 min_size=8 * 1024, max_size=256 * 1024, seed=0, host="127.0.0.1", port=0):
+        self.latency = latency              # 每个请求的首字节延迟(秒)
+        self.bandwidth = bandwidth          # 每个连接的带宽(字节/秒)，0为不限制
+        self.error_rate = error_rate        # 返回503的概率
+        self.truncate_rate = truncate_rate  # 只发送一半数据后断开连接的概率
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.stats = Counter()
+        self.runner = None
+
+        self.images = {}
+        entries = []
+        for i in range(image_count):
+            category = self.random.choice(CATEGORIES)
+            name = f"{i:05d}{self.random.choice(NAMES)}.gif"
+            path = f"{IMAGE_PREFIX}{category}/{name}"
+            size = self.random.randint(min_size, max_size)
+            self.images[path] = make_gif(self.random.randint(64, 512), self.random.randint(64, 512), size)
+            entries.append({"name": name, "category": category, "url": f"https://raw.githubusercontent.com/{path}"})
+        self.index = json.dumps({"status": 1000, "info": "fake", "data": entries}, ensure_ascii=False).encode("utf-8")
+        self.index_etag = '"' + hashlib.sha1(self.index).hexdigest()[:16] + '"'
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def mirror_template(self):
+        """插件 download_mirrors 配置使用的镜像模板"""
+        return self.base_url + "/{path}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request):
+        path = request.match_info["path"]
+        self.stats["requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if path == INDEX_PATH:
+            self.stats["index"] += 1
+            if request.headers.get("If-None-Match") == self.index_etag:
+                self.stats["index_not_modified"] += 1
+                return web.Response(status=304, headers={"ETag": self.index_etag})
+            return await self.send_body(request, self.index, "application/json", {"ETag": self.index_etag})
+
+        body = self.images.get(path)
+        if body is None:
+            self.stats["not_found"] += 1
+            return web.Response(status=404)
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.Response(status=503)
+        self.stats["images"] += 1
+        return await self.send_body(request, body, "image/gif")
+
+    async def send_body(self, request, body, content_type, headers=None):
+        """按带宽限制分块发送，按截断率只发送一半数据并断开连接"""
+        truncated = self.random.random() < self.truncate_rate
+        response = web.StreamResponse(headers=headers or {})
+        response.content_type = content_type
+        response.content_length = len(body)
+        if truncated:
+            self.stats["truncated"] += 1
+            response.force_close()
+        await response.prepare(request)
+
+        payload = body[:len(body) // 2] if truncated else body
+        chunk_size = 16 * 1024
+        for offset in range(0, len(payload), chunk_size):
+            chunk = payload[offset:offset + chunk_size]
+            await response.write(chunk)
+            self.stats["bytes_sent"] += len(chunk)
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+        if truncated:
+            # 不发送剩余数据直接断开，客户端收到的内容短于Content-Length
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟CDN")
+    parser.add_argument("--images", type=int, default=200, help="合成表情包数量")
+    parser.add_argument("--latency", type=float, default=0.0, help="首字节延迟(秒)")
+    parser.add_argument("--bandwidth", type=int, default=0, help="每连接带宽(字节/秒)，0为不限制")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503的概率")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="截断响应的概率")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    async def serve():
+        cdn = await FakeCDN(args.images, args.latency, args.bandwidth, args.error_rate, args.truncate_rate, port=args.port).start()
+        print(f"模拟CDN已启动: {cdn.base_url}")
+        print(f"download_mirrors: [\"{cdn.mirror_template}\"]")
+        try:
+            while True:
+                await asyncio.sleep(60)
+                print(f"[{time.strftime('%H:%M:%S')}] {dict(cdn.stats)}")
+        finally:
+            await cdn.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()